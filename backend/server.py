@@ -1,12 +1,16 @@
-from fastapi import FastAPI, Form, APIRouter, WebSocket, HTTPException, Depends, status
+from fastapi import FastAPI, Form, APIRouter, WebSocket, HTTPException, Depends, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+from pymongo import ASCENDING, CursorType, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+from pydantic import BaseModel, Field, ValidationError
+from typing import Callable, List, Optional, Dict, Set
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from bson import ObjectId
@@ -16,7 +20,20 @@ import uuid
 import logging
 from pathlib import Path
 import stripe
+from stripe.http_client import RequestsClient
 import json
+import time
+import hashlib
+import secrets
+import bisect
+import heapq
+import csv
+import io
+import codecs
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 def serialize_objectid(obj):
     """Convierte ObjectId de MongoDB a string para JSON"""
@@ -42,17 +59,69 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # Stripe configuración
 stripe.api_key = os.environ['STRIPE_API_KEY']
 stripe_publishable_key = os.environ['STRIPE_PUBLISHABLE_KEY']
+# Permite apuntar a un servidor local (p. ej. stripe-mock) en desarrollo y pruebas
+if os.environ.get('STRIPE_API_BASE'):
+    stripe.api_base = os.environ['STRIPE_API_BASE']
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+# Antigüedad máxima de un estado no final antes de volver a consultarlo en Stripe
+CHECKOUT_STATUS_MAX_AGE_SECONDS = float(os.environ.get('CHECKOUT_STATUS_MAX_AGE_SECONDS', '30'))
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '15'))
+STRIPE_WORKERS = int(os.environ.get('STRIPE_WORKERS', '8'))
+stripe.max_network_retries = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# Cliente HTTP con sesión persistente (pool de conexiones) y timeout
+stripe.default_http_client = RequestsClient(timeout=STRIPE_TIMEOUT_SECONDS)
+stripe_executor = ThreadPoolExecutor(max_workers=STRIPE_WORKERS, thread_name_prefix="stripe")
 
 # MongoDB conexión
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# WebSocket
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get('WS_SEND_TIMEOUT_SECONDS', '5'))
+WS_QUEUE_MAX_SIZE = int(os.environ.get('WS_QUEUE_MAX_SIZE', '100'))
+# Política al llenarse la cola de salida: drop_oldest, coalesce o disconnect
+WS_OVERFLOW_POLICY = os.environ.get('WS_OVERFLOW_POLICY', 'drop_oldest')
+WS_HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get('WS_HEARTBEAT_INTERVAL_SECONDS', '25'))
+WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get('WS_IDLE_TIMEOUT_SECONDS', '90'))
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', '5000'))
+WS_MAX_CONNECTIONS_PER_USER = int(os.environ.get('WS_MAX_CONNECTIONS_PER_USER', '5'))
+# Buffer de reenvío de notificaciones personales tras una reconexión
+NOTIFICATION_REPLAY_SIZE = int(os.environ.get('NOTIFICATION_REPLAY_SIZE', '50'))
+NOTIFICATION_REPLAY_USERS = int(os.environ.get('NOTIFICATION_REPLAY_USERS', '1000'))
+NOTIFICATION_REPLAY_TTL_SECONDS = int(os.environ.get('NOTIFICATION_REPLAY_TTL_SECONDS', '86400'))
+# Solo se guarda en memoria para usuarios con sesión en este worker o cerrada hace menos de esto;
+# el resto de reenvíos se sirven desde Mongo
+NOTIFICATION_REPLAY_BUFFER_TTL_SECONDS = int(os.environ.get('NOTIFICATION_REPLAY_BUFFER_TTL_SECONDS', '600'))
+# Ventana para agrupar varias notificaciones del mismo destinatario en un frame (0 = desactivado)
+NOTIFICATION_COALESCE_WINDOW_SECONDS = float(os.environ.get('NOTIFICATION_COALESCE_WINDOW_SECONDS', '0.25'))
+# Bus de notificaciones entre workers: memory (un solo proceso) o mongo
+NOTIFICATION_BUS = os.environ.get('NOTIFICATION_BUS', 'memory')
+NOTIFICATION_BUS_COLLECTION = os.environ.get('NOTIFICATION_BUS_COLLECTION', 'notification_bus')
+NOTIFICATION_BUS_SIZE_BYTES = int(os.environ.get('NOTIFICATION_BUS_SIZE_BYTES', str(16 * 1024 * 1024)))
+# Margen al reanudar el cursor: los _id y created_at los generan los workers y no están ordenados entre sí
+NOTIFICATION_BUS_RESUME_SLACK_SECONDS = float(os.environ.get('NOTIFICATION_BUS_RESUME_SLACK_SECONDS', '10'))
+NOTIFICATION_BUS_SEEN_IDS = int(os.environ.get('NOTIFICATION_BUS_SEEN_IDS', '10000'))
+
+# Cachés en proceso
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '1024'))
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get('TOKEN_CACHE_TTL_SECONDS', '300'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '4096'))
+# Red de seguridad por si una invalidación entre workers se pierde
+SERVICES_CACHE_TTL_SECONDS = float(os.environ.get('SERVICES_CACHE_TTL_SECONDS', '300'))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt libera el GIL, así que un pool de hilos acotado saca el trabajo del event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs_pending = 0
 
 # Security
 security = HTTPBearer()
+# Para endpoints que aceptan también otra credencial (p. ej. el token del feed)
+optional_security = HTTPBearer(auto_error=False)
 app = FastAPI(title="Plataforma de reservas de servicios de limpieza")
 api_router = APIRouter(prefix="/api")
 
@@ -189,8 +258,10 @@ class PaymentTransaction(BaseModel):
     amount: float
     currency: str = "usd"
     payment_status: str = "pending"
+    status: str = "open"
     metadata: Dict = {}
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Review(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -205,50 +276,555 @@ class ReviewCreate(BaseModel):
     rating: int
     comment: str
 
+class TTLCache:
+    """Caché LRU acotada con expiración por entrada"""
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def pop_where(self, predicate):
+        """Elimina las entradas cuyo valor cumple el predicado"""
+        for key, (value, _) in list(self._entries.items()):
+            if predicate(value):
+                del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
 # Notification Manager
-class NotificationManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.admin_connections: Dict[str, WebSocket] = {}
-        self.client_connections: Dict[str, WebSocket] = {}
+class ClientConnection:
+    """WebSocket con cola de salida acotada, drenada por su propia tarea de escritura.
+
+    Quien notifica solo encola; la latencia de un cliente lento queda aislada en
+    su tarea y no se propaga a la petición que generó la notificación.
+    """
+    __slots__ = ("websocket", "user_id", "queue", "dropped", "closed", "last_activity", "ping_queued", "_ready", "_on_close", "_writer_task")
+
+    def __init__(self, websocket: WebSocket, user_id: str, on_close=None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: deque = deque()
+        self.dropped = 0
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.ping_queued = False
+        self._ready = asyncio.Event()
+        self._on_close = on_close
+        self._writer_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def touch(self):
+        """Registra actividad del cliente (cualquier mensaje recibido, incluido el pong)"""
+        self.last_activity = time.monotonic()
+
+    def enqueue(self, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        """Encola un mensaje aplicando WS_OVERFLOW_POLICY; devuelve False si se descartó"""
+        if self.closed:
+            return False
+
+        if WS_OVERFLOW_POLICY == "coalesce" and coalesce_key is not None:
+            for index, (key, _) in enumerate(self.queue):
+                if key == coalesce_key:
+                    self.queue[index] = (coalesce_key, payload)
+                    return True
+
+        if len(self.queue) >= WS_QUEUE_MAX_SIZE:
+            self.dropped += 1
+            if WS_OVERFLOW_POLICY == "disconnect":
+                logger.warning(f"Cola llena para {self.user_id}, cerrando conexión")
+                # Se marca cerrada ya, para que los siguientes enqueue no lancen más cierres
+                if self._detach():
+                    notification_manager.schedule(self._close_socket(status.WS_1013_TRY_AGAIN_LATER))
+                return False
+            if self.queue.popleft()[0] == "ping":
+                self.ping_queued = False
+
+        self.queue.append((coalesce_key, payload))
+        self._ready.set()
+        return True
+
+    def enqueue_ping(self, payload: str) -> bool:
+        """Encola un ping salvo que ya haya uno pendiente o la cola esté llena.
+
+        Independiente de WS_OVERFLOW_POLICY: un ping nunca desplaza notificaciones
+        reales ni se acumula en clientes lentos.
+        """
+        if self.closed or self.ping_queued or len(self.queue) >= WS_QUEUE_MAX_SIZE:
+            return False
+        self.ping_queued = True
+        self.queue.append(("ping", payload))
+        self._ready.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                key, payload = self.queue.popleft()
+                if key == "ping":
+                    self.ping_queued = False
+                await asyncio.wait_for(self.websocket.send_text(payload), WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error enviando mensaje a {self.user_id}: {e!r}")
+            await self.close()
+
+    def stop(self):
+        """Detiene la tarea de escritura y libera la cola"""
+        self.closed = True
+        self.queue.clear()
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+
+    def _detach(self) -> bool:
+        """Marca la sesión como cerrada y la desregistra; False si ya lo estaba"""
+        if self.closed:
+            return False
+        self.stop()
+        if self._on_close:
+            self._on_close(self)
+        return True
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self._detach():
+            await self._close_socket(code)
+
+class InMemoryNotificationBus:
+    """Bus local: entrega en el mismo proceso. Válido con un solo worker y en pruebas"""
+    def __init__(self, handler=None):
+        self._handler = handler
+
+    async def start(self, handler):
+        self._handler = handler
+
+    async def publish(self, envelope: Dict):
+        if self._handler:
+            await self._handler(envelope)
+
+    async def stop(self):
+        self._handler = None
+
+class MongoNotificationBus:
+    """Bus entre workers sobre una colección capped de Mongo leída con un cursor tailable.
+
+    Cada worker publica insertando un documento y todos (incluido el emisor) lo
+    reciben y lo entregan a sus sockets locales. A diferencia de los change streams,
+    funciona también con un Mongo standalone sin replica set.
+
+    Los _id se generan en cada worker, así que no sirven para reanudar con $gt:
+    el cursor se reabre desde created_at menos un margen y los documentos ya
+    entregados se descartan con un conjunto acotado de _id vistos.
+    """
+    def __init__(self, database, collection_name: str, size_bytes: int):
+        self.database = database
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.collection = database[collection_name]
+        self._handler = None
+        self._task: Optional[asyncio.Task] = None
+        self._seen_order = deque()
+        self._seen: Set = set()
+
+    def _mark_seen(self, doc_id) -> bool:
+        """Registra el _id; devuelve False si ya se había visto"""
+        if doc_id in self._seen:
+            return False
+        self._seen.add(doc_id)
+        self._seen_order.append(doc_id)
+        if len(self._seen_order) > NOTIFICATION_BUS_SEEN_IDS:
+            self._seen.discard(self._seen_order.popleft())
+        return True
+
+    def _resume_query(self, since: datetime) -> Dict:
+        return {"created_at": {"$gte": since - timedelta(seconds=NOTIFICATION_BUS_RESUME_SLACK_SECONDS)}}
+
+    async def start(self, handler):
+        self._handler = handler
+        try:
+            await self.database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+        except OperationFailure as e:
+            # Otro worker la creó entre la comprobación y la creación (NamespaceExists)
+            if e.code != 48:
+                raise
+        # Un cursor tailable sobre una colección vacía muere al instante
+        if await self.collection.find_one(sort=[("$natural", -1)]) is None:
+            await self.collection.insert_one({"envelope": None, "created_at": datetime.utcnow()})
+        # Lo publicado antes de arrancar (dentro del margen) se marca como visto sin entregarlo
+        since = datetime.utcnow()
+        async for doc in self.collection.find(self._resume_query(since), {"_id": 1}):
+            self._mark_seen(doc["_id"])
+        self._task = asyncio.create_task(self._listen(since))
+
+    async def _listen(self, since: datetime):
+        while True:
+            try:
+                cursor = self.collection.find(self._resume_query(since), cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        if not self._mark_seen(doc["_id"]):
+                            continue
+                        since = max(since, doc.get("created_at") or since)
+                        if doc.get("envelope"):
+                            try:
+                                await self._handler(doc["envelope"])
+                            except Exception as e:
+                                logger.error(f"Error entregando notificación del bus: {e!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error leyendo el bus de notificaciones: {e!r}")
+            await asyncio.sleep(1)
 
-    async def connect(self, user_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        logger.info(f"Conexión establecida para el usuario: {user_id}")
+    async def publish(self, envelope: Dict):
+        await self.collection.insert_one({"envelope": envelope, "created_at": datetime.utcnow()})
 
-    async def connect_admin(self, websocket: WebSocket, admin_id: str):
-        await websocket.accept()
-        self.admin_connections[admin_id] = websocket
-        logger.info(f"Admin conectado: {admin_id}")
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
 
-    async def connect_client(self, websocket: WebSocket, user_id: str):
+class NotificationManager:
+    def __init__(self):
+        # Cada usuario puede tener varias sesiones abiertas (pestañas, dispositivos)
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
+        self.admin_connections: Dict[str, Set[ClientConnection]] = {}
+        self.client_connections: Dict[str, Set[ClientConnection]] = {}
+        self.registries = {
+            "user": self.active_connections,
+            "admin": self.admin_connections,
+            "client": self.client_connections
+        }
+        self._background_tasks = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._pending_batches: Dict[tuple, List[tuple]] = {}
+        # Cachés locales a invalidar cuando otro worker publica un cambio: nombre -> callback
+        self.invalidation_handlers: Dict[str, Callable[[], None]] = {}
+        # Eventos de estado compartido entre workers: target -> callback(envelope)
+        self.event_handlers: Dict[str, Callable[[Dict], None]] = {}
+        # Últimas notificaciones por usuario: user_id -> deque[(seq, payload)]
+        self.replay_buffers = TTLCache(NOTIFICATION_REPLAY_USERS, NOTIFICATION_REPLAY_BUFFER_TTL_SECONDS)
+        # Usuarios cuya última sesión en este worker se cerró hace poco: user_id -> True
+        self.recently_disconnected = TTLCache(NOTIFICATION_REPLAY_USERS, NOTIFICATION_REPLAY_BUFFER_TTL_SECONDS)
+        # Hasta que se llame a start() entrega localmente
+        self.bus = InMemoryNotificationBus(self.deliver)
+
+    async def start(self, bus=None):
+        """Conecta el manager al bus de notificaciones; cada worker entrega a sus sockets locales"""
+        if bus is not None:
+            self.bus = bus
+        await self.bus.start(self.deliver)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        await self.bus.stop()
+
+    async def _heartbeat(self):
+        """Envía pings periódicos y cierra las sesiones sin actividad dentro de WS_IDLE_TIMEOUT_SECONDS"""
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL_SECONDS)
+            try:
+                await self.reap_idle()
+                ping = json.dumps({"type": "ping", "timestamp": datetime.utcnow().isoformat()})
+                for role in self.registries:
+                    for connection in self.role_connections(role):
+                        connection.enqueue_ping(ping)
+            except Exception as e:
+                logger.error(f"Error en heartbeat de WebSocket: {e!r}")
+
+    async def reap_idle(self) -> int:
+        deadline = time.monotonic() - WS_IDLE_TIMEOUT_SECONDS
+        idle = [
+            connection
+            for role in self.registries
+            for connection in self.role_connections(role)
+            if connection.last_activity < deadline
+        ]
+        for connection in idle:
+            logger.info(f"Cerrando conexión inactiva de {connection.user_id}")
+            await connection.close(code=status.WS_1001_GOING_AWAY)
+        return len(idle)
+
+    def connection_count(self) -> int:
+        return sum(len(sessions) for registry in self.registries.values() for sessions in registry.values())
+
+    async def deliver(self, envelope: Dict):
+        """Entrega un mensaje del bus a las conexiones de este proceso.
+
+        Con NOTIFICATION_COALESCE_WINDOW_SECONDS > 0, los eventos para el mismo
+        destinatario dentro de la ventana se agrupan en un único frame.
+        """
+        if envelope["target"] == "invalidate":
+            handler = self.invalidation_handlers.get(envelope["cache"])
+            if handler:
+                handler()
+            return
+        if envelope["target"] in self.event_handlers:
+            self.event_handlers[envelope["target"]](envelope)
+            return
+
+        payload = envelope["payload"]
+        if envelope["target"] == "user" and envelope.get("seq") is not None:
+            self._buffer(envelope["user_id"], envelope["seq"], payload)
+
+        if NOTIFICATION_COALESCE_WINDOW_SECONDS <= 0:
+            for connection in self._recipients(envelope):
+                connection.enqueue(payload, coalesce_key=envelope.get("coalesce_key"))
+            return
+
+        key = (envelope["target"], envelope.get("user_id") or envelope.get("role"))
+        batch = self._pending_batches.get(key)
+        if batch is None:
+            batch = self._pending_batches[key] = []
+            asyncio.get_running_loop().call_later(
+                NOTIFICATION_COALESCE_WINDOW_SECONDS, self._flush_batch, key, envelope
+            )
+        batch.append((envelope.get("seq"), payload, envelope.get("coalesce_key")))
+
+    def _flush_batch(self, key: tuple, envelope: Dict):
+        batch = self._pending_batches.pop(key, [])
+        if not batch:
+            return
+        if len(batch) == 1:
+            _, payload, coalesce_key = batch[0]
+        else:
+            seqs = [seq for seq, _, _ in batch if seq is not None]
+            header = json.dumps({
+                "type": "notification_batch",
+                "count": len(batch),
+                "seq": max(seqs) if seqs else None
+            })
+            # Los payloads ya vienen serializados: se concatenan sin volver a parsearlos
+            payload = header[:-1] + ', "notifications": [' + ", ".join(p for _, p, _ in batch) + "]}"
+            coalesce_key = None
+        for connection in self._recipients(envelope):
+            connection.enqueue(payload, coalesce_key=coalesce_key)
+
+    def _recipients(self, envelope: Dict) -> List[ClientConnection]:
+        if envelope["target"] == "admins":
+            return self.role_connections("admin")
+        if envelope["target"] == "role":
+            return self.role_connections(envelope["role"])
+        if envelope["target"] == "user":
+            return list(self.active_connections.get(envelope["user_id"], ()))
+        return []
+
+    def _buffer(self, user_id: str, seq: int, payload: str):
+        """Guarda la notificación solo si el usuario tiene o tuvo hace poco sesión en este worker"""
+        if user_id not in self.active_connections and self.recently_disconnected.get(user_id) is None:
+            self.replay_buffers.pop(user_id)
+            return
+        buffer = self.replay_buffers.get(user_id)
+        if buffer is None:
+            buffer = deque(maxlen=NOTIFICATION_REPLAY_SIZE)
+        buffer.append((seq, payload))
+        self.replay_buffers.set(user_id, buffer)
+
+    async def _record(self, user_id: str, message_data: Dict) -> Dict:
+        """Asigna el siguiente seq del usuario y persiste la notificación para poder reenviarla"""
+        try:
+            counter = await db.notification_sequences.find_one_and_update(
+                {"user_id": user_id},
+                {"$inc": {"seq": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            message_data = {**message_data, "seq": counter["seq"]}
+            await db.notifications.insert_one({
+                "user_id": user_id,
+                "seq": counter["seq"],
+                "payload": json.dumps(message_data),
+                "created_at": datetime.utcnow()
+            })
+        except PyMongoError as e:
+            logger.error(f"No se pudo persistir la notificación para {user_id}: {e}")
+        return message_data
+
+    async def replay_entries(self, user_id: str, last_seen: int) -> List[tuple]:
+        """(seq, payload) de las notificaciones con seq > last_seen, en orden.
+
+        Usa el buffer en memoria si cubre el hueco completo; si no, lo lee de Mongo.
+        """
+        buffer = self.replay_buffers.get(user_id)
+        if buffer and buffer[0][0] <= last_seen + 1:
+            entries = [(seq, payload) for seq, payload in buffer if seq > last_seen]
+        else:
+            entries = []
+            cursor = db.notifications.find(
+                {"user_id": user_id, "seq": {"$gt": last_seen}},
+                {"_id": 0, "seq": 1, "payload": 1}
+            ).sort("seq", 1).limit(NOTIFICATION_REPLAY_SIZE)
+            async for doc in cursor:
+                entries.append((doc["seq"], doc["payload"]))
+        return entries
+
+    def role_connections(self, role: str) -> List[ClientConnection]:
+        """Todas las sesiones locales de un rol (user, admin o client)"""
+        registry = self.registries.get(role, {})
+        return [connection for sessions in registry.values() for connection in sessions]
+
+    async def _register(
+        self,
+        registry: Dict[str, Set[ClientConnection]],
+        key: str,
+        websocket: WebSocket,
+        initial: Optional[List[str]] = None
+    ) -> Optional[ClientConnection]:
+        """Acepta y registra la sesión.
+
+        Si se supera el límite global la rechaza y devuelve None; si se supera el
+        límite por usuario expulsa la sesión menos activa de ese usuario.
+
+        Los mensajes de `initial` se encolan antes de registrarla, de modo que ningún
+        mensaje en vivo puede adelantarlos.
+        """
+        if self.connection_count() >= WS_MAX_CONNECTIONS:
+            logger.warning(f"Límite global de WebSockets alcanzado, rechazando a {key}")
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return None
+        sessions = registry.get(key, ())
+        if len(sessions) >= WS_MAX_CONNECTIONS_PER_USER:
+            # Las sesiones zombis (sin pong) son las de menor actividad: se expulsa la
+            # más antigua en lugar de rechazar la nueva. Con 1000 el cliente no reintenta.
+            stale = min(sessions, key=lambda session: session.last_activity)
+            logger.warning(f"Límite de sesiones por usuario alcanzado para {key}, cerrando la menos activa")
+            await stale.close(code=status.WS_1000_NORMAL_CLOSURE)
         await websocket.accept()
-        self.client_connections[user_id] = websocket
-        logger.info(f"Cliente conectado: {user_id}")
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+        connection = ClientConnection(websocket, key, on_close=lambda conn: self._unregister(registry, key, conn))
+        for payload in initial or ():
+            connection.enqueue(payload)
+        registry.setdefault(key, set()).add(connection)
+        connection.start()
+        return connection
+
+    def _unregister(self, registry: Dict[str, Set[ClientConnection]], key: str, connection: Optional[ClientConnection] = None) -> bool:
+        """Quita una sesión concreta, o todas las del usuario si no se indica ninguna"""
+        sessions = registry.get(key)
+        if not sessions:
+            return False
+        if connection is None:
+            removed = list(sessions)
+            sessions.clear()
+        elif connection in sessions:
+            removed = [connection]
+            sessions.discard(connection)
+        else:
+            return False
+        if not sessions:
+            del registry[key]
+            if registry is self.active_connections:
+                self.recently_disconnected.set(key, True)
+        for session in removed:
+            session.stop()
+        return True
+
+    async def connect(self, user_id: str, websocket: WebSocket, last_seen: Optional[int] = None) -> Optional[ClientConnection]:
+        """Registra la sesión; con last_seen reenvía primero las notificaciones perdidas.
+
+        Lo publicado entre la lectura del reenvío y el registro se recupera con una
+        segunda lectura; los posibles duplicados los descarta el cliente por seq.
+        """
+        entries = await self.replay_entries(user_id, last_seen) if last_seen is not None else []
+        connection = await self._register(
+            self.active_connections, user_id, websocket, initial=[payload for _, payload in entries]
+        )
+        if connection is None:
+            return None
+        logger.info(f"Conexión establecida para el usuario: {user_id}")
+        if last_seen is not None:
+            since = entries[-1][0] if entries else last_seen
+            for _, payload in await self.replay_entries(user_id, since):
+                connection.enqueue(payload)
+        return connection
+
+    async def connect_admin(self, websocket: WebSocket, admin_id: str) -> Optional[ClientConnection]:
+        connection = await self._register(self.admin_connections, admin_id, websocket)
+        if connection:
+            logger.info(f"Admin conectado: {admin_id}")
+        return connection
+
+    async def connect_client(self, websocket: WebSocket, user_id: str) -> Optional[ClientConnection]:
+        connection = await self._register(self.client_connections, user_id, websocket)
+        if connection:
+            logger.info(f"Cliente conectado: {user_id}")
+        return connection
+
+    def disconnect(self, user_id: str, connection: Optional[ClientConnection] = None):
+        if self._unregister(self.active_connections, user_id, connection):
             logger.info(f"Conexión cerrada para el usuario: {user_id}")
 
-    def disconnect_admin(self, admin_id: str):
-        if admin_id in self.admin_connections:
-            del self.admin_connections[admin_id]
+    def disconnect_admin(self, admin_id: str, connection: Optional[ClientConnection] = None):
+        if self._unregister(self.admin_connections, admin_id, connection):
             logger.info(f"Admin desconectado: {admin_id}")
 
-    def disconnect_client(self, user_id: str):
-        if user_id in self.client_connections:
-            del self.client_connections[user_id]
+    def disconnect_client(self, user_id: str, connection: Optional[ClientConnection] = None):
+        if self._unregister(self.client_connections, user_id, connection):
             logger.info(f"Cliente desconectado: {user_id}")
 
     async def send_personal_message(self, message_data: dict, user_id: str):
         """Envía mensaje JSON estructurado"""
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message_data))
-            except Exception as e:
-                logger.error(f"Error enviando mensaje a {user_id}: {e}")
+        message_data = await self._record(user_id, message_data)
+        await self.bus.publish({
+            "target": "user",
+            "user_id": user_id,
+            "seq": message_data.get("seq"),
+            "payload": json.dumps(message_data),
+            "coalesce_key": self._coalesce_key(message_data)
+        })
+
+    @staticmethod
+    def _coalesce_key(message_data: Dict) -> Optional[str]:
+        if message_data.get("booking_id"):
+            return f"{message_data.get('category')}:{message_data['booking_id']}"
+        return None
 
     async def notify_booking_confirmed(self, user_id: str, booking_data: Dict):
         """Notifica confirmación de reserva con datos estructurados"""
@@ -262,6 +838,16 @@ class NotificationManager:
         }
         await self.send_personal_message(message_data, user_id)
 
+    async def notify_bookings_confirmed(self, confirmations: List[tuple]):
+        """Notifica en paralelo un lote de confirmaciones [(user_id, booking_data)]"""
+        results = await asyncio.gather(
+            *(self.notify_booking_confirmed(user_id, booking_data) for user_id, booking_data in confirmations),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error notificando confirmación: {result!r}")
+
     async def notify_new_booking(self, booking_data: Dict):
         """Notifica nueva reserva a todos los admins"""
         message_data = {
@@ -275,21 +861,103 @@ class NotificationManager:
             "amount": booking_data.get('amount'),
             "timestamp": datetime.utcnow().isoformat()
         }
-        
-        for admin_id, websocket in self.admin_connections.items():
-            try:
-                await websocket.send_text(json.dumps(message_data))
-            except Exception as e:
-                logger.error(f"Error enviando notificación a admin {admin_id}: {e}")
+        await self.broadcast_admins(json.dumps(message_data), coalesce_key=self._coalesce_key(message_data))
+
+    async def broadcast_admins(self, payload: str, coalesce_key: Optional[str] = None):
+        """Publica el payload ya serializado para todos los admins del cluster"""
+        await self.bus.publish({"target": "admins", "payload": payload, "coalesce_key": coalesce_key})
+
+    async def publish_event(self, target: str, **data):
+        """Publica un evento de estado para los handlers registrados en todos los workers"""
+        await self.bus.publish({"target": target, **data})
+
+    async def publish_invalidation(self, cache_name: str):
+        """Pide a todos los workers (incluido este) que invaliden una caché local"""
+        await self.bus.publish({"target": "invalidate", "cache": cache_name})
+
+    async def broadcast_role(self, role: str, payload: str, coalesce_key: Optional[str] = None):
+        """Publica el payload para todas las sesiones de un rol en el cluster"""
+        await self.bus.publish({"target": "role", "role": role, "payload": payload, "coalesce_key": coalesce_key})
+
+    def schedule(self, coro):
+        """Lanza una notificación en segundo plano sin bloquear la petición que la origina"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def stats(self) -> Dict:
+        connections = [connection for role in self.registries for connection in self.role_connections(role)]
+        depths = [len(connection.queue) for connection in connections]
+        return {
+            "connections": len(connections),
+            "users": sum(len(registry) for registry in self.registries.values()),
+            "connections_by_role": {role: len(self.role_connections(role)) for role in self.registries},
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_messages": sum(connection.dropped for connection in connections),
+            "overflow_policy": WS_OVERFLOW_POLICY,
+            "bus": type(self.bus).__name__
+        }
 
 notification_manager = NotificationManager()
 
+def create_notification_bus():
+    if NOTIFICATION_BUS == "mongo":
+        return MongoNotificationBus(db, NOTIFICATION_BUS_COLLECTION, NOTIFICATION_BUS_SIZE_BYTES)
+    return InMemoryNotificationBus()
+
+# Usuarios resueltos por get_current_active_user, indexados por el "sub" del token (email)
+user_cache = TTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
+# Payloads de JWT ya verificados, indexados por el token completo
+token_cache = TTLCache(TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
+def invalidate_cached_user(user_id: Optional[str] = None, email: Optional[str] = None):
+    """Elimina de la caché al usuario por email o por id"""
+    if email:
+        user_cache.pop(email)
+    if user_id:
+        user_cache.pop_where(lambda cached_user: cached_user.id == user_id)
+
+notification_manager.event_handlers["user_cache"] = lambda envelope: invalidate_cached_user(
+    envelope.get("user_id"), envelope.get("email")
+)
+
+async def publish_user_invalidation(user_id: Optional[str] = None, email: Optional[str] = None):
+    """Invalida al usuario en la caché de este worker y, vía bus, en la del resto"""
+    invalidate_cached_user(user_id=user_id, email=email)
+    await notification_manager.publish_event("user_cache", user_id=user_id, email=email)
+
 # Utility functions
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def run_password_job(func, *args):
+    """Ejecuta una operación de bcrypt en el pool dedicado"""
+    global password_jobs_pending
+    password_jobs_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs_pending -= 1
+
+def password_pool_stats() -> Dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "pending": password_jobs_pending,
+        "queue_depth": max(0, password_jobs_pending - PASSWORD_HASH_WORKERS)
+    }
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def run_stripe_call(func, **kwargs):
+    """Ejecuta una llamada síncrona del SDK de Stripe fuera del event loop"""
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(
+        loop.run_in_executor(stripe_executor, lambda: func(**kwargs)),
+        timeout=STRIPE_TIMEOUT_SECONDS * (stripe.max_network_retries + 1)
+    )
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await run_password_job(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -300,6 +968,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def decode_token(token: str) -> Dict:
+    """Verifica y decodifica un JWT reutilizando el resultado mientras no expire.
+
+    Lanza JWTError si el token no es válido.
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    ttl = TOKEN_CACHE_TTL_SECONDS
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    token_cache.set(token, payload, ttl_seconds=ttl)
+    return payload
+
 async def get_current_active_user(token: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -307,14 +991,18 @@ async def get_current_active_user(token: HTTPAuthorizationCredentials = Depends(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token.credentials)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    
+
+    cached_user = user_cache.get(token_data.username)
+    if cached_user is not None:
+        return cached_user
+
     user = await db.users.find_one({"email": token_data.username})
     if user is None:
         raise credentials_exception
@@ -332,8 +1020,10 @@ async def get_current_active_user(token: HTTPAuthorizationCredentials = Depends(
         "document_number": user.get("document_number"),
         "profile_picture_url": user.get("profile_picture_url")
     }
-    
-    return User(**user_data)
+
+    current_user = User(**user_data)
+    user_cache.set(token_data.username, current_user)
+    return current_user
 
 async def get_current_user(current_user: User = Depends(get_current_active_user)):
     return current_user
@@ -343,6 +1033,95 @@ async def get_current_admin(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
 
+def build_user(user: Dict, default_role: str = "customer") -> User:
+    """Construye el modelo User a partir de un documento de la colección users"""
+    return User(
+        id=user["id"],
+        username=user.get("username", user["email"]),
+        email=user["email"],
+        full_name=user.get("full_name", ""),
+        phone=user.get("phone", ""),
+        role=user.get("role", default_role),
+        hashed_password=user["hashed_password"],
+        is_active=user.get("is_active", True),
+        created_at=user.get("created_at", datetime.utcnow()),
+        document_number=user.get("document_number"),
+        profile_picture_url=user.get("profile_picture_url")
+    )
+
+# Paginación por cursor y streaming NDJSON
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 200
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(cursor)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_page(collection, query: Dict, limit: int, cursor: Optional[str] = None):
+    """Devuelve una página ordenada por _id (orden de inserción) y el cursor de la siguiente.
+
+    El cursor es el _id del último documento entregado, así que cada página es
+    una consulta por rango sobre el índice de _id sin importar su posición.
+    """
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    if cursor:
+        query = {**query, "_id": {"$gt": decode_cursor(cursor)}}
+    docs = await collection.find(query).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+async def iter_transformed_batches(collection, query: Dict, transform):
+    """Recorre el cursor de Motor en lotes de STREAM_BATCH_SIZE y aplica `transform` a cada lote"""
+    batch = []
+    async for doc in collection.find(query).sort("_id", 1).batch_size(STREAM_BATCH_SIZE):
+        batch.append(doc)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield await transform(batch)
+            batch = []
+    if batch:
+        yield await transform(batch)
+
+def stream_ndjson(collection, query: Dict, transform) -> StreamingResponse:
+    """Emite los documentos como NDJSON directamente desde el cursor de Motor, por lotes"""
+    async def generate():
+        async for items in iter_transformed_batches(collection, query, transform):
+            yield "".join(json.dumps(jsonable_encoder(item)) + "\n" for item in items)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+async def list_response(
+    collection,
+    query: Dict,
+    transform,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    """Resuelve los modos de listado comunes.
+
+    - stream: NDJSON con memoria constante.
+    - limit/cursor: {"items": [...], "next_cursor": ...}.
+    - sin parámetros: lista plana de hasta MAX_PAGE_LIMIT elementos; si quedan más,
+      la cabecera X-Next-Cursor (y Link rel="next") indica desde dónde continuar.
+    """
+    if stream:
+        return stream_ndjson(collection, query, transform)
+    if limit is None and cursor is None:
+        docs, next_cursor = await fetch_page(collection, query, MAX_PAGE_LIMIT)
+        response = JSONResponse(content=jsonable_encoder(await transform(docs)))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+            response.headers["Link"] = f'<?limit={MAX_PAGE_LIMIT}&cursor={next_cursor}>; rel="next"'
+        return response
+    docs, next_cursor = await fetch_page(collection, query, limit or DEFAULT_PAGE_LIMIT, cursor)
+    return JSONResponse(content=jsonable_encoder({
+        "items": await transform(docs),
+        "next_cursor": next_cursor
+    }))
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -353,25 +1132,44 @@ async def root():
     return {"message": "Cleaning Service API", "status": "running"}
 
 # WebSocket endpoints
+def is_pong(data: str) -> bool:
+    """Respuesta del cliente al ping del heartbeat"""
+    if data == "pong":
+        return True
+    if not data.startswith("{"):
+        return False
+    try:
+        return json.loads(data).get("type") == "pong"
+    except ValueError:
+        return False
+
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str, token: str = None):
-    """WebSocket principal con validación de token"""
+async def websocket_endpoint(websocket: WebSocket, user_id: str, token: str = None, last_seen: Optional[int] = None):
+    """WebSocket principal con validación de token.
+
+    Si se indica last_seen (último seq recibido), reenvía las notificaciones perdidas.
+    """
     if token:
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = decode_token(token)
             username = payload.get("sub")
             if username:
                 user = await db.users.find_one({"email": username})
                 if user and user["id"] == user_id:
-                    await notification_manager.connect(user_id, websocket)
+                    connection = await notification_manager.connect(user_id, websocket, last_seen)
+                    if connection is None:
+                        return
                     try:
                         while True:
                             data = await websocket.receive_text()
-                            await websocket.send_text(f"Echo: {data}")
+                            connection.touch()
+                            if is_pong(data):
+                                continue
+                            connection.enqueue(f"Echo: {data}")
                     except Exception as e:
                         logger.error(f"WebSocket error for user {user_id}: {e}")
                     finally:
-                        notification_manager.disconnect(user_id)
+                        notification_manager.disconnect(user_id, connection)
                     return
         except JWTError as e:
             logger.error(f"JWT Error in WebSocket: {e}")
@@ -383,20 +1181,25 @@ async def employee_websocket(websocket: WebSocket, employee_id: str, token: str
     """WebSocket para empleados"""
     if token:
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = decode_token(token)
             username = payload.get("sub")
             if username:
                 user = await db.users.find_one({"email": username})
                 if user and user["id"] == employee_id and user.get("role") == "employee":
-                    await notification_manager.connect(employee_id, websocket)
+                    connection = await notification_manager.connect(employee_id, websocket)
+                    if connection is None:
+                        return
                     try:
                         while True:
                             data = await websocket.receive_text()
-                            await websocket.send_text(f"Employee Echo: {data}")
+                            connection.touch()
+                            if is_pong(data):
+                                continue
+                            connection.enqueue(f"Employee Echo: {data}")
                     except Exception as e:
                         logger.error(f"Employee WebSocket error for {employee_id}: {e}")
                     finally:
-                        notification_manager.disconnect(employee_id)
+                        notification_manager.disconnect(employee_id, connection)
                     return
         except JWTError as e:
             logger.error(f"JWT Error in Employee WebSocket: {e}")
@@ -408,20 +1211,25 @@ async def admin_websocket(websocket: WebSocket, admin_id: str, token: str = None
     """WebSocket para administradores"""
     if token:
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = decode_token(token)
             username = payload.get("sub")
             if username:
                 user = await db.users.find_one({"email": username})
                 if user and user["id"] == admin_id and user.get("role") == "admin":
-                    await notification_manager.connect_admin(websocket, admin_id)
+                    connection = await notification_manager.connect_admin(websocket, admin_id)
+                    if connection is None:
+                        return
                     try:
                         while True:
                             data = await websocket.receive_text()
-                            await websocket.send_text(f"Admin Echo: {data}")
+                            connection.touch()
+                            if is_pong(data):
+                                continue
+                            connection.enqueue(f"Admin Echo: {data}")
                     except Exception as e:
                         logger.error(f"Admin WebSocket error for {admin_id}: {e}")
                     finally:
-                        notification_manager.disconnect_admin(admin_id)
+                        notification_manager.disconnect_admin(admin_id, connection)
                     return
         except JWTError as e:
             logger.error(f"JWT Error in Admin WebSocket: {e}")
@@ -432,7 +1240,7 @@ async def admin_websocket(websocket: WebSocket, admin_id: str, token: str = None
 @api_router.post("/auth/register")
 async def register(user_in: UserCreate):
     user_id = str(uuid.uuid4())
-    hashed_password = pwd_context.hash(user_in.password)
+    hashed_password = await get_password_hash(user_in.password)
     user_doc = {
         "id": user_id,
         "username": user_in.username,
@@ -446,13 +1254,18 @@ async def register(user_in: UserCreate):
         "document_number": user_in.document_number,
         "profile_picture_url": user_in.profile_picture_url
     }
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await record_user_stats(1)
+    await publish_user_invalidation(email=user_in.email)
     return {"message": "User registered successfully"}
 
 @api_router.post("/auth/login")
 async def login(username: str = Form(...), password: str = Form(...)):
     user = await db.users.find_one({"email": username})
-    if not user or not pwd_context.verify(password, user["hashed_password"]):
+    if not user or not await verify_password(password, user["hashed_password"]):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
     access_token = create_access_token(data={"sub": user["email"]})
@@ -478,7 +1291,7 @@ async def read_current_user(current_user: User = Depends(get_current_active_user
 async def login_form(username: str = Form(...), password: str = Form(...)):
     """Endpoint alternativo para login con form-data"""
     user = await db.users.find_one({"email": username})
-    if not user or not pwd_context.verify(password, user["hashed_password"]):
+    if not user or not await verify_password(password, user["hashed_password"]):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
     access_token = create_access_token(data={"sub": user["email"]})
@@ -491,21 +1304,109 @@ async def login_form(username: str = Form(...), password: str = Form(...)):
     return {"access_token": access_token, "token_type": "bearer", "user": user_response}
 
 # Service endpoints
-@api_router.get("/services", response_model=List[Service])
-async def get_services():
-    services = await db.services.find({"is_active": True}).to_list(1000)
+async def build_services(services: List[Dict]) -> List[Service]:
     return [Service(**service) for service in services]
 
+# Respuesta serializada de GET /services: (body, etag). Se invalida en cada mutación de servicios
+services_cache = TTLCache(1, SERVICES_CACHE_TTL_SECONDS)
+services_cache_version = 0
+
+def invalidate_services_cache():
+    global services_cache_version
+    services_cache_version += 1
+    services_cache.clear()
+
+notification_manager.invalidation_handlers["services"] = invalidate_services_cache
+
+class ServiceCatalog:
+    """Instantánea en memoria de los servicios (activos e inactivos) para el camino de escritura.
+
+    Se recarga cuando services_cache_version cambia (mutación local o invalidación
+    recibida por el bus) o cuando supera SERVICES_CACHE_TTL_SECONDS.
+    """
+    def __init__(self):
+        self.services: Dict[str, Dict] = {}
+        self.version = -1
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return (
+            self.version == services_cache_version
+            and time.monotonic() - self.loaded_at < SERVICES_CACHE_TTL_SECONDS
+        )
+
+    async def refresh(self):
+        async with self._lock:
+            if self.is_fresh():
+                return
+            version = services_cache_version
+            projection = {"_id": 0, "id": 1, "name": 1, "hourly_rate": 1, "is_active": 1}
+            services = {service["id"]: service async for service in db.services.find({}, projection)}
+            self.services = services
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    async def get(self, service_id: str) -> Optional[Dict]:
+        if not self.is_fresh():
+            await self.refresh()
+        service = self.services.get(service_id)
+        if service is None:
+            # Puede ser un servicio creado en otro worker cuya invalidación aún no llegó
+            service = await db.services.find_one({"id": service_id})
+        return service
+
+service_catalog = ServiceCatalog()
+
+async def services_changed():
+    invalidate_services_cache()
+    await notification_manager.publish_invalidation("services")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+@api_router.get("/services", response_model=List[Service])
+async def get_services(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    if limit is not None or cursor is not None or stream:
+        return await list_response(db.services, {"is_active": True}, build_services, limit, cursor, stream)
+
+    cached = services_cache.get("active")
+    if cached is None:
+        version = services_cache_version
+        services, _ = await fetch_page(db.services, {"is_active": True}, MAX_PAGE_LIMIT)
+        body = json.dumps(jsonable_encoder(await build_services(services))).encode()
+        cached = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+        # Si hubo una mutación durante la consulta, no guardar un resultado viejo
+        if version == services_cache_version:
+            services_cache.set("active", cached)
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @api_router.post("/services", response_model=Service)
 async def create_service(service: ServiceCreate, current_user: User = Depends(get_current_admin)):
     new_service = Service(**service.dict())
     await db.services.insert_one(new_service.dict())
+    await services_changed()
     return new_service
 
 @api_router.put("/services/{service_id}", response_model=Service)
 async def update_service(service_id: str, service: ServiceCreate, current_user: User = Depends(get_current_admin)):
     service_dict = service.dict()
     await db.services.update_one({"id": service_id}, {"$set": service_dict})
+    await services_changed()
     updated_service = await db.services.find_one({"id": service_id})
     if not updated_service:
         raise HTTPException(status_code=404, detail="Service not found")
@@ -514,12 +1415,13 @@ async def update_service(service_id: str, service: ServiceCreate, current_user:
 @api_router.delete("/services/{service_id}")
 async def delete_service(service_id: str, current_user: User = Depends(get_current_admin)):
     await db.services.update_one({"id": service_id}, {"$set": {"is_active": False}})
+    await services_changed()
     return {"message": "Service deleted successfully"}
 
 # Booking endpoints
 @api_router.post("/bookings", response_model=Booking)
 async def create_booking(booking: BookingCreate, current_user: User = Depends(get_current_user)):
-    service = await db.services.find_one({"id": booking.service_id})
+    service = await service_catalog.get(booking.service_id)
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
     
@@ -533,13 +1435,14 @@ async def create_booking(booking: BookingCreate, current_user: User = Depends(ge
     
     new_booking = Booking(**booking_dict)
     await db.bookings.insert_one(new_booking.dict())
+    await booking_changed(None, new_booking.dict())
     
-    await notification_manager.notify_new_booking({
+    notification_manager.schedule(notification_manager.notify_new_booking({
         "service": service["name"],
         "amount": total_amount,
         "user": current_user.full_name,
         "id": new_booking.id
-    })
+    }))
     
     return new_booking
 
@@ -549,127 +1452,799 @@ async def create_booking_alt(booking_in: BookingIn):
     booking_id = str(uuid.uuid4())
     booking_doc = {**booking_in.dict(), "id": booking_id, "created_at": datetime.utcnow().isoformat()}
     await db.bookings.insert_one(booking_doc)
+    await booking_changed(None, booking_doc)
     return {"message": "Booking created successfully", "booking_id": booking_id}
 
-@api_router.get("/bookings", response_model=List[Dict])
-async def get_all_bookings():
-    """Obtiene todas las reservas con información enriquecida de usuarios y empleados"""
-    bookings = await db.bookings.find().to_list(1000)
-
+# Enriquecimiento de reservas
+BOOKING_USER_PROJECTION = {"_id": 0, "id": 1, "full_name": 1, "phone": 1}
+BOOKING_SERVICE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "description": 1}
+
+async def fetch_by_ids(collection, ids, projection: Dict) -> Dict[str, Dict]:
+    """Resuelve un conjunto de ids con una sola consulta $in y devuelve un dict id -> documento"""
+    if not ids:
+        return {}
+    docs_by_id = {}
+    async for doc in collection.find({"id": {"$in": list(ids)}}, projection):
+        docs_by_id[doc["id"]] = doc
+    return docs_by_id
+
+async def enrich_bookings(bookings: List[Dict], view: str) -> List[Dict]:
+    """Enriquece un lote de reservas con datos de usuarios, empleados y servicios.
+
+    Recoge todos los ids referenciados y los resuelve con una consulta por colección,
+    de modo que el número de round-trips no depende del número de reservas.
+    `view` selecciona la proyección: "public", "user", "admin" o "employee".
+    """
+    user_ids = set()
+    service_ids = set()
     for booking in bookings:
-        user = await db.users.find_one({"id": booking["user_id"]})
-        if user:
-            booking["full_name"] = user.get("full_name", "Usuario Desconocido")
-        else:
-            booking["full_name"] = "Usuario Desconocido"
-            
-        if booking.get("assigned_employee_id"):
-            employee = await db.users.find_one({"id": booking["assigned_employee_id"]})
-            if employee:
-                booking["employee_full_name"] = employee.get("full_name", "Empleado Desconocido")
-            else:
-                booking["employee_full_name"] = "Empleado Desconocido"
-        else:
-            booking["employee_full_name"] = None
-            
-    return bookings
+        if view in ("public", "admin", "employee") and booking.get("user_id"):
+            user_ids.add(booking["user_id"])
+        if view in ("public", "user", "admin") and booking.get("assigned_employee_id"):
+            user_ids.add(booking["assigned_employee_id"])
+        if view != "public" and not booking.get("service_name") and booking.get("service_id"):
+            service_ids.add(booking["service_id"])
+
+    users_by_id = await fetch_by_ids(db.users, user_ids, BOOKING_USER_PROJECTION)
+    services_by_id = await fetch_by_ids(db.services, service_ids, BOOKING_SERVICE_PROJECTION)
 
-@api_router.get("/bookings/user")
-async def get_user_bookings(current_user: User = Depends(get_current_user)):
-    """Obtiene las reservas del usuario actual, enriquecidas con datos del empleado."""
-    bookings = await db.bookings.find({"user_id": current_user.id}).to_list(1000)
     enriched_bookings = []
-    
     for booking in bookings:
         booking = serialize_objectid(booking)
-        
-        if not booking.get("service_name") and booking.get("service_id"):
-            service = await db.services.find_one({"id": booking["service_id"]})
+
+        if view != "public" and not booking.get("service_name") and booking.get("service_id"):
+            service = services_by_id.get(booking["service_id"])
             if service:
                 booking["service_name"] = service["name"]
-                booking["service_description"] = service.get("description", "")
-        
-        # Información del empleado
-        booking["employee_full_name"] = None
-        booking["employee_phone"] = None
-        
-        if booking.get("assigned_employee_id"):
-            employee = await db.users.find_one({"id": booking["assigned_employee_id"]})
-            if employee:
-                booking["employee_full_name"] = employee.get("full_name")
-                booking["employee_phone"] = employee.get("phone")
-        
-        booking.setdefault("service_description", "")
-        booking.setdefault("status", "pending")
-        
+                if view == "user":
+                    booking["service_description"] = service.get("description", "")
+
+        if view in ("public", "admin"):
+            user = users_by_id.get(booking.get("user_id"))
+            booking["full_name"] = user.get("full_name", "Usuario Desconocido") if user else "Usuario Desconocido"
+
+        if view == "employee":
+            customer = users_by_id.get(booking.get("user_id"))
+            booking["customer_full_name"] = customer.get("full_name", "Cliente Desconocido") if customer else "Cliente Desconocido"
+
+        employee = users_by_id.get(booking.get("assigned_employee_id")) if booking.get("assigned_employee_id") else None
+        if view == "public":
+            if booking.get("assigned_employee_id"):
+                booking["employee_full_name"] = employee.get("full_name", "Empleado Desconocido") if employee else "Empleado Desconocido"
+            else:
+                booking["employee_full_name"] = None
+        elif view == "user":
+            booking["employee_full_name"] = employee.get("full_name") if employee else None
+            booking["employee_phone"] = employee.get("phone") if employee else None
+            booking.setdefault("service_description", "")
+            booking.setdefault("status", "pending")
+        elif view == "admin" and employee:
+            booking["employee_full_name"] = employee.get("full_name")
+            booking["employee_phone"] = employee.get("phone")
+
         enriched_bookings.append(booking)
-    
+
     return enriched_bookings
 
+def booking_view(view: str):
+    async def transform(bookings: List[Dict]) -> List[Dict]:
+        return await enrich_bookings(bookings, view)
+    return transform
+
+# Importación y exportación masiva de reservas
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+EXPORT_COLUMNS = [
+    "id", "user_id", "full_name", "service_id", "service_name", "booking_date", "start_time", "end_time",
+    "hourly_rate", "total_hours", "total_amount", "status", "address", "special_instructions",
+    "assigned_employee_id", "employee_full_name", "employee_phone", "payment_session_id", "created_at"
+]
+
+async def iter_request_lines(request: Request):
+    """Líneas del cuerpo de la petición decodificadas de forma incremental (memoria acotada)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def iter_import_rows(request: Request, fmt: str):
+    """Produce (número de fila, dict) para CSV (una fila por línea, con cabecera) o NDJSON"""
+    header = None
+    row_number = 0
+    async for line in iter_request_lines(request):
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [column.strip() for column in values]
+                continue
+            row_number += 1
+            yield row_number, {key: value for key, value in zip(header, values) if value != ""}
+        else:
+            row_number += 1
+            try:
+                yield row_number, json.loads(line)
+            except ValueError as e:
+                yield row_number, e
+
+async def insert_import_batch(batch: List[tuple], report: Dict):
+    """Inserta un lote validado con insert_many(ordered=False) y registra los errores por fila"""
+    documents = [document for _, document in batch]
+    failed = set()
+    try:
+        await db.bookings.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed.add(error["index"])
+            add_import_error(report, batch[error["index"]][0], error.get("errmsg", "Write error"))
+    inserted = [document for index, (_, document) in enumerate(batch) if index not in failed]
+    report["imported"] += len(inserted)
+    await bookings_changed([(None, document) for document in inserted])
+
+def add_import_error(report: Dict, row_number: int, message: str):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row_number, "error": message})
+
+@api_router.post("/admin/bookings/import")
+async def import_bookings(request: Request, format: str = "ndjson", current_user: User = Depends(get_current_admin)):
+    """Importa reservas desde un cuerpo CSV o NDJSON leído en streaming.
+
+    Cada fila se valida con BookingIn; las válidas se insertan en lotes de
+    IMPORT_BATCH_SIZE y las inválidas se reportan con su número de fila.
+    """
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format")
+
+    report = {"imported": 0, "failed": 0, "errors": []}
+    batch: List[tuple] = []
+    async for row_number, row in iter_import_rows(request, format):
+        if isinstance(row, Exception):
+            add_import_error(report, row_number, f"Invalid JSON: {row}")
+            continue
+        try:
+            booking_in = BookingIn(**row)
+        except (ValidationError, TypeError) as e:
+            add_import_error(report, row_number, str(e))
+            continue
+        batch.append((row_number, {**booking_in.dict(), "id": str(uuid.uuid4()), "created_at": datetime.utcnow().isoformat()}))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await insert_import_batch(batch, report)
+            batch = []
+    if batch:
+        await insert_import_batch(batch, report)
+
+    logger.info(f"Admin {current_user.id} importó {report['imported']} reservas ({report['failed']} con error)")
+    return report
+
+@api_router.get("/admin/bookings/export")
+async def export_bookings(format: str = "ndjson", current_user: User = Depends(get_current_admin)):
+    """Exporta todas las reservas con los campos enriquecidos de /bookings/admin, en streaming"""
+    if format == "ndjson":
+        return stream_ndjson(db.bookings, {}, booking_view("admin"))
+    if format != "csv":
+        raise HTTPException(status_code=400, detail="Invalid format")
+
+    async def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        async for items in iter_transformed_batches(db.bookings, {}, booking_view("admin")):
+            writer.writerows(jsonable_encoder(items))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=bookings.csv"}
+    )
+
+@api_router.get("/bookings", response_model=List[Dict])
+async def get_all_bookings(limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    """Obtiene todas las reservas con información enriquecida de usuarios y empleados"""
+    return await list_response(db.bookings, {}, booking_view("public"), limit, cursor, stream)
+
+@api_router.get("/bookings/user")
+async def get_user_bookings(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Obtiene las reservas del usuario actual, enriquecidas con datos del empleado."""
+    return await list_response(db.bookings, {"user_id": current_user.id}, booking_view("user"), limit, cursor, stream)
+
 @api_router.get("/bookings/admin")
-async def get_all_bookings_admin(current_user: User = Depends(get_current_admin)):
+async def get_all_bookings_admin(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_admin)
+):
     """Obtiene todas las reservas para administradores"""
-    bookings = await db.bookings.find().to_list(1000)
-    enriched_bookings = []
-    
-    for booking in bookings:
-        booking = serialize_objectid(booking)
-        
-        if not booking.get("service_name") and booking.get("service_id"):
-            service = await db.services.find_one({"id": booking["service_id"]})
-            if service:
-                booking["service_name"] = service["name"]
-        
-        user = await db.users.find_one({"id": booking["user_id"]})
-        if user:
-            booking["full_name"] = user.get("full_name", "Usuario Desconocido")
-        else:
-            booking["full_name"] = "Usuario Desconocido"
-        
-        # Información del empleado
-        if booking.get("assigned_employee_id"):
-            employee = await db.users.find_one({"id": booking["assigned_employee_id"]})
-            if employee:
-                booking["employee_full_name"] = employee.get("full_name")
-                booking["employee_phone"] = employee.get("phone")
-        
-        enriched_bookings.append(booking)
-    
-    return enriched_bookings
+    return await list_response(db.bookings, {}, booking_view("admin"), limit, cursor, stream)
+
+# Feed de calendario de empleados
+EMPLOYEE_FEED_PAST_DAYS = int(os.environ.get('EMPLOYEE_FEED_PAST_DAYS', '7'))
+EMPLOYEE_FEED_FUTURE_DAYS = int(os.environ.get('EMPLOYEE_FEED_FUTURE_DAYS', '60'))
+# Amplitud máxima de un rango from/to; evita cargar el histórico completo en memoria
+EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS = int(os.environ.get('EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS', '366'))
+# Campos que aparecen en el feed; el validador (ETag) se calcula solo sobre ellos
+FEED_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "service_id": 1, "service_name": 1, "booking_date": 1,
+    "start_time": 1, "end_time": 1, "status": 1, "address": 1, "special_instructions": 1,
+    "created_at": 1, "updated_at": 1
+}
+ICS_STATUSES = {"pending": "TENTATIVE", "confirmed": "CONFIRMED", "completed": "CONFIRMED", "cancelled": "CANCELLED"}
+
+async def check_assignments_access(employee_id: str, current_user: User):
+    employee_user = await db.users.find_one({"id": employee_id, "role": "employee"}, {"_id": 0, "id": 1})
+    if not employee_user:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    if current_user.role != "admin" and current_user.id != employee_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view these assignments")
+
+def feed_token_hash(token: str) -> str:
+    """Solo se guarda el hash del token del feed; el token en claro se muestra una vez"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def authorize_feed(
+    employee_id: str,
+    feed_token: Optional[str],
+    credentials: Optional[HTTPAuthorizationCredentials]
+):
+    """Autoriza el feed con el token propio del empleado (?token=) o con el Bearer habitual.
+
+    Las apps de calendario no pueden enviar cabeceras, por eso el token va en la URL.
+    Deja de valer al rotarlo o revocarlo y si el empleado se desactiva.
+    """
+    if feed_token:
+        feed, employee_user = await asyncio.gather(
+            db.employee_feeds.find_one(
+                {"employee_id": employee_id, "token_hash": feed_token_hash(feed_token)}, {"_id": 0, "employee_id": 1}
+            ),
+            db.users.find_one(
+                {"id": employee_id, "role": "employee", "is_active": {"$ne": False}}, {"_id": 0, "id": 1}
+            )
+        )
+        if not feed or not employee_user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid feed token")
+        return
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    current_user = await get_current_active_user(credentials)
+    await check_assignments_access(employee_id, current_user)
+
+async def record_feed_changes(changes: List[tuple]):
+    """Marca la hora del último cambio de cada empleado afectado.
+
+    Cubre también borrados y reasignaciones, que no dejan documento en el feed del
+    empleado anterior y por tanto no se reflejarían en el máximo de updated_at.
+    """
+    employee_ids = {
+        booking["assigned_employee_id"]
+        for old, new in changes
+        for booking in (old, new)
+        if booking and booking.get("assigned_employee_id")
+    }
+    if not employee_ids:
+        return
+    now = datetime.utcnow()
+    try:
+        await db.employee_feeds.bulk_write([
+            UpdateOne({"employee_id": employee_id}, {"$max": {"modified_at": now}}, upsert=True)
+            for employee_id in employee_ids
+        ], ordered=False)
+    except PyMongoError as e:
+        logger.error(f"No se pudo registrar el cambio en los feeds de empleados: {e}")
+
+def employee_range_query(employee_id: str, date_from: Optional[str], date_to: Optional[str]) -> Dict:
+    """Reservas del empleado en un rango de fechas.
+
+    Repite la igualdad sobre assigned_employee_id dentro de cada rama del $or para
+    que ambas se resuelvan con el índice (assigned_employee_id, booking_date).
+    """
+    if date_from is None and date_to is None:
+        return {"assigned_employee_id": employee_id}
+    try:
+        date_query = booking_date_range_query(date_from, date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    return {"$or": [{"assigned_employee_id": employee_id, **branch} for branch in date_query["$or"]]}
+
+def bounded_range(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """Completa un rango abierto y rechaza (400) los que superan EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS"""
+    max_span = timedelta(days=EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS)
+    try:
+        start = datetime.fromisoformat(date_from).date() if date_from else None
+        end = datetime.fromisoformat(date_to).date() if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    start = start or end - max_span
+    end = end or start + max_span
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if end - start > max_span:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range cannot exceed {EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS} days"
+        )
+    return start.isoformat(), end.isoformat()
 
 @api_router.get("/employee/assignments/{employee_id}")
 async def get_employee_assignments(
     employee_id: str, 
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Obtiene todas las asignaciones de reservas para un empleado específico."""
-    employee_user = await db.users.find_one({"id": employee_id, "role": "employee"})
-    if not employee_user:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    if current_user.role != "admin" and current_user.id != employee_id:
-        raise HTTPException(status_code=403, detail="Not authorized to view these assignments")
-    
-    bookings = await db.bookings.find({"assigned_employee_id": employee_id}).to_list(1000)
-    
-    enriched_bookings = []
+    """Obtiene las asignaciones de reservas de un empleado, opcionalmente entre `from` y `to` (inclusive).
+
+    El rango no puede superar EMPLOYEE_ASSIGNMENTS_MAX_RANGE_DAYS y devuelve como
+    mucho MAX_PAGE_LIMIT reservas.
+    """
+    await check_assignments_access(employee_id, current_user)
+    if date_from or date_to:
+        date_from, date_to = bounded_range(date_from, date_to)
+        query = employee_range_query(employee_id, date_from, date_to)
+        bookings = await db.bookings.find(query).sort("booking_date", 1).to_list(MAX_PAGE_LIMIT)
+    else:
+        bookings = await db.bookings.find({"assigned_employee_id": employee_id}).to_list(1000)
+    return await enrich_bookings(bookings, "employee")
+
+def as_utc_datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def feed_validators(bookings: List[Dict], format: str, feed_state: Optional[Dict]) -> tuple:
+    """(ETag, Last-Modified) del feed a partir de los documentos proyectados"""
+    digest = hashlib.sha1(json.dumps(jsonable_encoder(bookings), sort_keys=True).encode()).hexdigest()
+    stamps = [as_utc_datetime(b.get("updated_at") or b.get("created_at")) for b in bookings]
+    if feed_state:
+        stamps.append(as_utc_datetime(feed_state.get("modified_at")))
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return f'"{format}-{digest}"', max(stamps) if stamps else None
+
+def not_modified_since(request: Request, last_modified: Optional[datetime]) -> bool:
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since or last_modified is None or request.headers.get("if-none-match"):
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+def ics_text(value) -> str:
+    return (
+        str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+def ics_fold(line: str) -> str:
+    """Pliega las líneas a 75 octetos como exige RFC 5545"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        # No cortar en mitad de un carácter UTF-8
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode("utf-8"))
+        encoded = encoded[size:]
+    return "\r\n ".join(parts)
+
+def ics_datetime(day: datetime, time_value: str) -> str:
+    hours, minutes = time_value.split(":")[:2]
+    return f"{day:%Y%m%d}T{int(hours):02d}{int(minutes):02d}00"
+
+def build_ics(employee_id: str, bookings: List[Dict]) -> str:
+    """Calendario iCalendar con un VEVENT por reserva (horas locales, sin zona horaria)"""
+    stamp = f"{datetime.utcnow():%Y%m%dT%H%M%SZ}"
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Proyecto Limpieza//Asignaciones//ES",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{ics_text('Asignaciones ' + employee_id)}",
+    ]
     for booking in bookings:
-        booking = serialize_objectid(booking)
-        
-        if not booking.get("service_name") and booking.get("service_id"):
-            service = await db.services.find_one({"id": booking["service_id"]})
-            if service:
-                booking["service_name"] = service["name"]
-        
-        customer = await db.users.find_one({"id": booking["user_id"]})
-        if customer:
-            booking["customer_full_name"] = customer.get("full_name", "Cliente Desconocido")
-        else:
-            booking["customer_full_name"] = "Cliente Desconocido"
-        
-        enriched_bookings.append(booking)
-    
-    return enriched_bookings
+        day = booking_day(booking)
+        try:
+            start = ics_datetime(day, booking["start_time"])
+            end = ics_datetime(day, booking["end_time"])
+        except (KeyError, ValueError, AttributeError, TypeError):
+            continue
+        description = f"Cliente: {booking.get('customer_full_name', '')}"
+        if booking.get("special_instructions"):
+            description += f"\n{booking['special_instructions']}"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{booking['id']}@proyecto-limpieza",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{start}",
+            f"DTEND:{end}",
+            f"SUMMARY:{ics_text(booking.get('service_name') or 'Servicio de limpieza')}",
+            f"LOCATION:{ics_text(booking.get('address'))}",
+            f"DESCRIPTION:{ics_text(description)}",
+            f"STATUS:{ICS_STATUSES.get(booking.get('status'), 'TENTATIVE')}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(ics_fold(line) for line in lines) + "\r\n"
+
+@api_router.get("/employee/assignments/{employee_id}/feed")
+async def get_employee_assignments_feed(
+    employee_id: str,
+    request: Request,
+    format: str = "ics",
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Feed de asignaciones (iCalendar o JSON) con GET condicional.
+
+    Se autentica con ?token= (ver /feed-token) o con el Bearer del usuario.
+
+    Sin rango explícito cubre de EMPLOYEE_FEED_PAST_DAYS atrás a
+    EMPLOYEE_FEED_FUTURE_DAYS adelante. El ETag se calcula con una consulta
+    proyectada sobre el índice; solo si cambió se resuelven los clientes y se
+    genera el cuerpo.
+    """
+    if format not in ("ics", "json"):
+        raise HTTPException(status_code=400, detail="Invalid format")
+    await authorize_feed(employee_id, token, credentials)
+
+    today = datetime.utcnow().date()
+    date_from = date_from or (today - timedelta(days=EMPLOYEE_FEED_PAST_DAYS)).isoformat()
+    date_to = date_to or (today + timedelta(days=EMPLOYEE_FEED_FUTURE_DAYS)).isoformat()
+    date_from, date_to = bounded_range(date_from, date_to)
+    query = employee_range_query(employee_id, date_from, date_to)
+    bookings, feed_state = await asyncio.gather(
+        db.bookings.find(query, FEED_PROJECTION).sort("booking_date", 1).to_list(MAX_PAGE_LIMIT),
+        db.employee_feeds.find_one({"employee_id": employee_id}, {"_id": 0, "modified_at": 1})
+    )
+
+    etag, last_modified = feed_validators(bookings, format, feed_state)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if etag_matches(request, etag) or not_modified_since(request, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    bookings = await enrich_bookings(bookings, "employee")
+    if format == "json":
+        return JSONResponse(content=jsonable_encoder(bookings), headers=headers)
+    return Response(content=build_ics(employee_id, bookings), media_type="text/calendar; charset=utf-8", headers=headers)
+
+@api_router.post("/employee/assignments/{employee_id}/feed-token")
+async def rotate_employee_feed_token(employee_id: str, current_user: User = Depends(get_current_active_user)):
+    """Genera (o rota) el token del feed de calendario; el anterior deja de valer"""
+    await check_assignments_access(employee_id, current_user)
+    feed_token = secrets.token_urlsafe(32)
+    await db.employee_feeds.update_one(
+        {"employee_id": employee_id},
+        {"$set": {"token_hash": feed_token_hash(feed_token), "token_created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    logger.info(f"Usuario {current_user.id} generó el token del feed del empleado {employee_id}")
+    return {"token": feed_token, "url": f"/api/employee/assignments/{employee_id}/feed?token={feed_token}"}
+
+@api_router.delete("/employee/assignments/{employee_id}/feed-token")
+async def revoke_employee_feed_token(employee_id: str, current_user: User = Depends(get_current_active_user)):
+    """Revoca el token del feed de calendario"""
+    await check_assignments_access(employee_id, current_user)
+    await db.employee_feeds.update_one(
+        {"employee_id": employee_id},
+        {"$unset": {"token_hash": "", "token_created_at": ""}}
+    )
+    logger.info(f"Usuario {current_user.id} revocó el token del feed del empleado {employee_id}")
+    return {"message": "Feed token revoked successfully"}
+
+# Locks entre workers
+EMPLOYEE_LOCK_TTL_SECONDS = float(os.environ.get('EMPLOYEE_LOCK_TTL_SECONDS', '30'))
+EMPLOYEE_LOCK_WAIT_SECONDS = float(os.environ.get('EMPLOYEE_LOCK_WAIT_SECONDS', '5'))
+
+async def acquire_lock(name: str, ttl_seconds: float) -> Optional[str]:
+    """Lock entre workers en la colección locks; caduca solo si quien lo tiene muere.
+
+    Devuelve el token del propietario (necesario para liberarlo) o None si está tomado.
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    try:
+        await db.locks.insert_one({"_id": name, "owner": token, "expires_at": expires_at})
+        return token
+    except DuplicateKeyError:
+        taken = await db.locks.find_one_and_update(
+            {"_id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": token, "expires_at": expires_at}}
+        )
+        return token if taken is not None else None
+
+async def release_lock(name: str, token: str):
+    """Libera el lock solo si sigue siendo nuestro (no uno tomado tras caducar)"""
+    await db.locks.delete_one({"_id": name, "owner": token})
+
+@asynccontextmanager
+async def employee_lock(employee_id: str):
+    """Serializa comprobación de solapes y asignación para un empleado en todo el cluster.
+
+    Espera hasta EMPLOYEE_LOCK_WAIT_SECONDS; si no lo consigue responde 409.
+    """
+    name = f"employee:{employee_id}"
+    deadline = time.monotonic() + EMPLOYEE_LOCK_WAIT_SECONDS
+    while True:
+        token = await acquire_lock(name, EMPLOYEE_LOCK_TTL_SECONDS)
+        if token:
+            break
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="Employee is being assigned concurrently, try again")
+        await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        await release_lock(name, token)
+
+# Agenda de empleados
+def time_to_minutes(value: str) -> int:
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+class EmployeeSchedule:
+    """Índice de intervalos por empleado y día para detectar solapamientos.
+
+    Cada día guarda los intervalos ordenados por inicio junto con el máximo de los
+    finales acumulado, de modo que "¿está libre?" es una búsqueda binaria.
+    """
+    def __init__(self):
+        # employee_id -> día -> (starts, intervals [(start, end, booking_id)], prefix_max_end)
+        self._days: Dict[str, Dict[str, tuple]] = {}
+        # booking_id -> (employee_id, día, start, end)
+        self._bookings: Dict[str, tuple] = {}
+
+    def _rebuild_day(self, employee_id: str, day: str, intervals: List[tuple]):
+        if not intervals:
+            self._days.get(employee_id, {}).pop(day, None)
+            if employee_id in self._days and not self._days[employee_id]:
+                del self._days[employee_id]
+            return
+        prefix_max = []
+        current = -1
+        for _, end, _ in intervals:
+            current = max(current, end)
+            prefix_max.append(current)
+        self._days.setdefault(employee_id, {})[day] = ([start for start, _, _ in intervals], intervals, prefix_max)
+
+    def add(self, booking_id: str, employee_id: str, day: str, start: int, end: int):
+        self.remove(booking_id)
+        _, intervals, _ = self._days.get(employee_id, {}).get(day, ([], [], []))
+        intervals = list(intervals)
+        bisect.insort(intervals, (start, end, booking_id))
+        self._rebuild_day(employee_id, day, intervals)
+        self._bookings[booking_id] = (employee_id, day, start, end)
+
+    def remove(self, booking_id: str):
+        entry = self._bookings.pop(booking_id, None)
+        if entry is None:
+            return
+        employee_id, day, _, _ = entry
+        _, intervals, _ = self._days.get(employee_id, {}).get(day, ([], [], []))
+        self._rebuild_day(employee_id, day, [interval for interval in intervals if interval[2] != booking_id])
+
+    def is_free(self, employee_id: str, day: str, start: int, end: int, exclude: Optional[str] = None) -> bool:
+        starts, intervals, prefix_max = self._days.get(employee_id, {}).get(day, ([], [], []))
+        # Solo pueden solaparse los intervalos que empiezan antes de `end`
+        index = bisect.bisect_left(starts, end)
+        if index == 0 or prefix_max[index - 1] <= start:
+            return True
+        if exclude is None or exclude not in self._bookings:
+            return False
+        return all(
+            booking_id == exclude or interval_end <= start
+            for _, interval_end, booking_id in intervals[:index]
+        )
+
+    def free_employees(self, employee_ids: List[str], day: str, start: int, end: int) -> List[str]:
+        return [employee_id for employee_id in employee_ids if self.is_free(employee_id, day, start, end)]
+
+    def apply(self, envelope: Dict):
+        for change in envelope["changes"]:
+            if change["entry"]:
+                self.add(change["booking_id"], *change["entry"])
+            else:
+                self.remove(change["booking_id"])
+
+    def load(self, employee_id: str, day_from: str, day_to: str) -> int:
+        """Número de reservas del empleado entre dos días (inclusive)"""
+        return sum(
+            len(intervals)
+            for day, (_, intervals, _) in self._days.get(employee_id, {}).items()
+            if day_from <= day <= day_to
+        )
+
+    def replace(self, other: "EmployeeSchedule"):
+        """Sustituye el contenido por el de otra agenda (recarga periódica desde Mongo)"""
+        self._days = other._days
+        self._bookings = other._bookings
+
+    def stats(self) -> Dict:
+        return {"employees": len(self._days), "bookings": len(self._bookings)}
+
+EMPLOYEE_SCHEDULE_RELOAD_SECONDS = float(os.environ.get('EMPLOYEE_SCHEDULE_RELOAD_SECONDS', '300'))
+employee_schedule = EmployeeSchedule()
+notification_manager.event_handlers["schedule"] = employee_schedule.apply
+
+def schedule_entry(booking: Optional[Dict]) -> Optional[tuple]:
+    """(employee_id, día, inicio, fin) si la reserva ocupa la agenda de un empleado"""
+    if not booking or not booking.get("assigned_employee_id") or booking.get("status") == "cancelled":
+        return None
+    day = booking_day(booking)
+    try:
+        start = time_to_minutes(booking["start_time"])
+        end = time_to_minutes(booking["end_time"])
+    except (KeyError, ValueError, AttributeError):
+        return None
+    if day is None:
+        return None
+    return (booking["assigned_employee_id"], day.date().isoformat(), start, end)
+
+async def sync_schedule(changes: List[tuple]):
+    """Refleja en la agenda (local y del resto de workers) los cambios de reservas con un solo evento"""
+    schedule_changes = []
+    for old, new in changes:
+        old_entry, new_entry = schedule_entry(old), schedule_entry(new)
+        if old_entry != new_entry:
+            schedule_changes.append({
+                "booking_id": (new or old)["id"],
+                "entry": list(new_entry) if new_entry else None
+            })
+    if not schedule_changes:
+        return
+    employee_schedule.apply({"changes": schedule_changes})
+    await notification_manager.publish_event("schedule", changes=schedule_changes)
+
+async def bookings_changed(changes: List[tuple]):
+    """Punto único tras escribir reservas: estadísticas, rollups y agenda, en lote"""
+    await asyncio.gather(record_booking_stats(changes), sync_schedule(changes), record_feed_changes(changes))
+
+async def booking_changed(old: Optional[Dict], new: Optional[Dict]):
+    await bookings_changed([(old, new)])
+
+async def load_employee_schedule() -> int:
+    """(Re)construye la agenda desde bookings, solo desde hoy en adelante.
+
+    Se ejecuta al arrancar y cada EMPLOYEE_SCHEDULE_RELOAD_SECONDS para corregir
+    la deriva si algún evento del bus se pierde.
+    """
+    fresh = EmployeeSchedule()
+    projection = {"_id": 0, "id": 1, "assigned_employee_id": 1, "booking_date": 1, "start_time": 1, "end_time": 1, "status": 1}
+    query = {
+        **booking_date_range_query(datetime.utcnow().date().isoformat(), None),
+        "assigned_employee_id": {"$ne": None},
+        "status": {"$ne": "cancelled"}
+    }
+    async for booking in db.bookings.find(query, projection):
+        entry = schedule_entry(booking)
+        if entry:
+            fresh.add(booking["id"], *entry)
+    employee_schedule.replace(fresh)
+    return fresh.stats()["bookings"]
+
+async def has_schedule_conflict(booking: Dict, employee_id: str) -> bool:
+    """Comprueba si el empleado tiene otra reserva solapada con `booking`.
+
+    La respuesta sale siempre de Mongo (reservas del empleado ese día, por el
+    índice compuesto), no de la agenda en memoria, que puede ir por detrás de
+    otros workers. Las horas se comparan en minutos, como en la agenda, para que
+    "9:00" y "09:00" sean equivalentes. Para que la comprobación y la asignación
+    posterior sean atómicas hay que llamarla con employee_lock tomado.
+    """
+    entry = schedule_entry({**booking, "assigned_employee_id": employee_id, "status": "confirmed"})
+    if entry is None:
+        return False
+    _, day, start, end = entry
+    query = employee_range_query(employee_id, day, day)
+    projection = {"_id": 0, "id": 1, "booking_date": 1, "start_time": 1, "end_time": 1, "status": 1, "assigned_employee_id": 1}
+    async for other in db.bookings.find(query, projection):
+        if other["id"] == booking["id"]:
+            continue
+        other_entry = schedule_entry(other)
+        if other_entry and other_entry[2] < end and start < other_entry[3]:
+            return True
+    return False
+
+@api_router.get("/employees/availability")
+async def get_available_employees(
+    date: str,
+    start_time: str,
+    end_time: str,
+    current_user: User = Depends(get_current_admin)
+):
+    """Empleados sin reservas solapadas en la franja indicada"""
+    try:
+        day = datetime.fromisoformat(date).date().isoformat()
+        start, end = time_to_minutes(start_time), time_to_minutes(end_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date or time format")
+    employees = await db.users.find(
+        {"role": "employee", "is_active": {"$ne": False}},
+        {"_id": 0, "id": 1, "full_name": 1, "phone": 1}
+    ).to_list(None)
+    free_ids = set(employee_schedule.free_employees([employee["id"] for employee in employees], day, start, end))
+    return [employee for employee in employees if employee["id"] in free_ids]
+
+# Máquina de estados de las reservas; confirmed -> confirmed es una reasignación de empleado
+BOOKING_TRANSITIONS = {
+    "pending": {"confirmed", "cancelled"},
+    "confirmed": {"confirmed", "completed", "cancelled"},
+    "completed": set(),
+    "cancelled": set(),
+}
+
+def booking_sources(status: str) -> List[str]:
+    """Estados desde los que se puede pasar a `status`"""
+    return [source for source, targets in BOOKING_TRANSITIONS.items() if status in targets]
+
+async def transition_booking(booking_id: str, status: str, extra: Optional[Dict] = None, guard: Optional[Dict] = None):
+    """Aplica una transición de estado en un único find_one_and_update con condiciones de guarda.
+
+    Devuelve (antes, después) o None si la reserva no existe o la guarda no se
+    cumple (transición inválida o modificada concurrentemente). Como solo se usa
+    $set, la imagen posterior se deriva de la anterior sin otra lectura.
+    """
+    if status not in BOOKING_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid booking status")
+    update_data = {"status": status, **(extra or {}), "updated_at": datetime.utcnow()}
+    booking = await db.bookings.find_one_and_update(
+        {"id": booking_id, "status": {"$in": booking_sources(status)}, **(guard or {})},
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    if booking is None:
+        return None
+    updated = {**booking, **update_data}
+    await booking_changed(booking, updated)
+    return booking, updated
+
+async def transition_failed(booking_id: str, status: str) -> HTTPException:
+    """Construye el error de una transición rechazada (solo se consulta en el camino de error)"""
+    current = await db.bookings.find_one({"id": booking_id}, {"_id": 0, "status": 1})
+    if current is None:
+        return HTTPException(status_code=404, detail="Booking not found")
+    if status not in BOOKING_TRANSITIONS.get(current.get("status"), set()):
+        return HTTPException(
+            status_code=409,
+            detail=f"Invalid status transition from {current.get('status')} to {status}"
+        )
+    return HTTPException(status_code=409, detail="Booking was modified concurrently")
 
 @api_router.put("/bookings/{booking_id}/assign")
 async def assign_employee(booking_id: str, data: Dict):
@@ -678,27 +2253,193 @@ async def assign_employee(booking_id: str, data: Dict):
     if not employee_id:
         raise HTTPException(status_code=400, detail="Employee ID is required")
 
-    employee = await db.users.find_one({"id": employee_id, "role": "employee"})
+    employee, current = await asyncio.gather(
+        db.users.find_one({"id": employee_id, "role": "employee"}, {"_id": 0, "id": 1}),
+        db.bookings.find_one({"id": booking_id})
+    )
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
-    
-    result = await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {"assigned_employee_id": employee_id, "status": "confirmed"}}
-    )
-    
-    if result.modified_count == 0:
+    if current is None:
         raise HTTPException(status_code=404, detail="Booking not found or already assigned")
-    
-    booking = await db.bookings.find_one({"id": booking_id})
-    if booking:
-        await notification_manager.notify_booking_confirmed(
-            user_id=booking["user_id"],
-            booking_data={"id": booking_id, "assigned_employee_id": employee_id}
+    if current.get("assigned_employee_id") == employee_id and current.get("status") == "confirmed":
+        raise HTTPException(status_code=404, detail="Booking not found or already assigned")
+
+    # El lock del empleado hace atómicas la comprobación de solapes y la escritura;
+    # la guarda sobre el empleado leído evita que dos admins asignen a la vez empleados distintos
+    async with employee_lock(employee_id):
+        if await has_schedule_conflict(current, employee_id):
+            raise HTTPException(status_code=409, detail="Employee not available for this time slot")
+        result = await transition_booking(
+            booking_id, "confirmed",
+            extra={"assigned_employee_id": employee_id},
+            guard={"assigned_employee_id": current.get("assigned_employee_id")}
         )
+    if result is None:
+        raise await transition_failed(booking_id, "confirmed")
+    booking, _ = result
+    await notification_manager.notify_booking_confirmed(
+        user_id=booking["user_id"],
+        booking_data={"id": booking_id, "assigned_employee_id": employee_id}
+    )
     
     return {"message": "Employee assigned successfully", "success": True}
 
+class AutoAssignRequest(BaseModel):
+    date_from: str
+    date_to: str
+
+def booking_date_range_query(date_from: Optional[str], date_to: Optional[str]) -> Dict:
+    """Filtro por booking_date (inclusive) válido para fechas guardadas como datetime o como texto ISO.
+
+    Cualquiera de los dos extremos puede omitirse para un rango abierto.
+    """
+    as_datetime, as_text = {"$type": "date"}, {"$type": "string"}
+    if date_from:
+        start = datetime.fromisoformat(date_from)
+        as_datetime["$gte"], as_text["$gte"] = start, start.date().isoformat()
+    if date_to:
+        end = datetime.fromisoformat(date_to) + timedelta(days=1)
+        as_datetime["$lt"], as_text["$lt"] = end, end.date().isoformat()
+    return {"$or": [{"booking_date": as_datetime}, {"booking_date": as_text}]}
+
+def plan_assignments(bookings: List[Dict], employee_ids: List[str], day_from: str, day_to: str) -> Dict[str, str]:
+    """Asigna reservas a empleados libres de forma voraz por hora de inicio.
+
+    Entre los empleados libres elige el de menor carga en el rango (reservas ya
+    asignadas más las de este plan), usando un heap por carga.
+    """
+    tentative = EmployeeSchedule()
+    heap = [(employee_schedule.load(employee_id, day_from, day_to), employee_id) for employee_id in employee_ids]
+    heapq.heapify(heap)
+    plan = {}
+    entries = []
+    for booking in bookings:
+        entry = schedule_entry({**booking, "assigned_employee_id": "_", "status": "confirmed"})
+        if entry:
+            entries.append((entry[1], entry[2], entry[3], booking["id"]))
+    for day, start, end, booking_id in sorted(entries):
+        skipped = []
+        chosen = None
+        while heap:
+            load, employee_id = heapq.heappop(heap)
+            if employee_schedule.is_free(employee_id, day, start, end) and tentative.is_free(employee_id, day, start, end):
+                chosen = (load, employee_id)
+                break
+            skipped.append((load, employee_id))
+        for item in skipped:
+            heapq.heappush(heap, item)
+        if chosen:
+            load, employee_id = chosen
+            tentative.add(booking_id, employee_id, day, start, end)
+            plan[booking_id] = employee_id
+            heapq.heappush(heap, (load + 1, employee_id))
+    return plan
+
+async def drop_conflicting_assignments(plan: Dict[str, str], bookings_by_id: Dict[str, Dict]) -> Dict[str, str]:
+    """Confirma el plan contra Mongo y descarta las asignaciones que se solapan.
+
+    La agenda en memoria puede ir por detrás de otros workers, así que se leen con
+    una sola consulta $in (índice assigned_employee_id + booking_date) las reservas
+    de los empleados del plan en los días afectados.
+    """
+    entries = {}
+    for booking_id, employee_id in plan.items():
+        entry = schedule_entry({**bookings_by_id[booking_id], "assigned_employee_id": employee_id, "status": "confirmed"})
+        if entry:
+            entries[booking_id] = entry
+    if not entries:
+        return {}
+    days = sorted(entry[1] for entry in entries.values())
+    employee_ids = sorted({entry[0] for entry in entries.values()})
+    query = employee_range_query({"$in": employee_ids}, days[0], days[-1])
+    projection = {"_id": 0, "id": 1, "assigned_employee_id": 1, "booking_date": 1, "start_time": 1, "end_time": 1, "status": 1}
+
+    stored = EmployeeSchedule()
+    async for booking in db.bookings.find(query, projection):
+        entry = schedule_entry(booking)
+        if entry and booking["id"] not in entries:
+            stored.add(booking["id"], *entry)
+
+    confirmed = {}
+    for booking_id, (employee_id, day, start, end) in sorted(entries.items(), key=lambda item: item[1][1:]):
+        if stored.is_free(employee_id, day, start, end):
+            stored.add(booking_id, employee_id, day, start, end)
+            confirmed[booking_id] = employee_id
+    return confirmed
+
+@api_router.post("/admin/bookings/auto-assign")
+async def auto_assign_bookings(data: AutoAssignRequest, current_user: User = Depends(get_current_admin)):
+    """Asigna empleados a todas las reservas pendientes del rango en una sola pasada"""
+    try:
+        date_query = booking_date_range_query(data.date_from, data.date_to)
+        day_from = datetime.fromisoformat(data.date_from).date().isoformat()
+        day_to = datetime.fromisoformat(data.date_to).date().isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+    bookings = await db.bookings.find(
+        {**date_query, "status": "pending", "assigned_employee_id": None}
+    ).to_list(None)
+    employees = await db.users.find(
+        {"role": "employee", "is_active": {"$ne": False}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+
+    plan = plan_assignments(bookings, [employee["id"] for employee in employees], day_from, day_to)
+    bookings_by_id = {booking["id"]: booking for booking in bookings}
+
+    # Se toman sin esperar los candados de los empleados del plan; los que estén
+    # ocupados por una asignación manual se quedan fuera de esta pasada
+    planned_employees = sorted(set(plan.values()))
+    tokens = await asyncio.gather(*[
+        acquire_lock(f"employee:{employee_id}", EMPLOYEE_LOCK_TTL_SECONDS) for employee_id in planned_employees
+    ])
+    locked = {employee_id: token for employee_id, token in zip(planned_employees, tokens) if token}
+    try:
+        plan = await drop_conflicting_assignments(
+            {booking_id: employee_id for booking_id, employee_id in plan.items() if employee_id in locked},
+            bookings_by_id
+        )
+        if plan:
+            # La condición status/assigned_employee_id evita pisar asignaciones hechas entre la lectura y la escritura
+            result = await db.bookings.bulk_write([
+                UpdateOne(
+                    {"id": booking_id, "status": "pending", "assigned_employee_id": None},
+                    {"$set": {"assigned_employee_id": employee_id, "status": "confirmed"}}
+                )
+                for booking_id, employee_id in plan.items()
+            ], ordered=False)
+            if result.modified_count < len(plan):
+                applied = await db.bookings.find(
+                    {"id": {"$in": list(plan)}, "status": "confirmed"},
+                    {"_id": 0, "id": 1, "assigned_employee_id": 1}
+                ).to_list(None)
+                applied_ids = {b["id"] for b in applied if plan.get(b["id"]) == b.get("assigned_employee_id")}
+                plan = {booking_id: employee_id for booking_id, employee_id in plan.items() if booking_id in applied_ids}
+    finally:
+        await asyncio.gather(*[
+            release_lock(f"employee:{employee_id}", token) for employee_id, token in locked.items()
+        ])
+
+    if not plan:
+        return {"assigned": 0, "assignments": [], "unassigned": [booking["id"] for booking in bookings]}
+
+    await bookings_changed([
+        (bookings_by_id[booking_id], {**bookings_by_id[booking_id], "assigned_employee_id": employee_id, "status": "confirmed"})
+        for booking_id, employee_id in plan.items()
+    ])
+    notification_manager.schedule(notification_manager.notify_bookings_confirmed([
+        (bookings_by_id[booking_id]["user_id"], {"id": booking_id, "assigned_employee_id": employee_id})
+        for booking_id, employee_id in plan.items()
+    ]))
+
+    logger.info(f"Admin {current_user.id} asignó automáticamente {len(plan)} de {len(bookings)} reservas")
+    return {
+        "assigned": len(plan),
+        "assignments": [{"booking_id": booking_id, "employee_id": employee_id} for booking_id, employee_id in plan.items()],
+        "unassigned": [booking["id"] for booking in bookings if booking["id"] not in plan]
+    }
+
 @api_router.put("/bookings/{booking_id}/status")
 async def update_booking_status(
     booking_id: str,
@@ -706,25 +2447,34 @@ async def update_booking_status(
     current_user: User = Depends(get_current_admin)
 ):
     """Actualiza el estado de una reserva"""
-    booking = await db.bookings.find_one({"id": booking_id})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    
-    update_data = {"status": booking_update.status}
-    
-    if booking_update.assigned_employee_id:
-        employee = await db.users.find_one({
-            "id": booking_update.assigned_employee_id, 
-            "role": "employee"
-        })
+    if booking_update.status not in BOOKING_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid booking status")
+
+    if not booking_update.assigned_employee_id:
+        result = await transition_booking(booking_id, booking_update.status)
+    else:
+        employee, current = await asyncio.gather(
+            db.users.find_one({"id": booking_update.assigned_employee_id, "role": "employee"}, {"_id": 0, "id": 1}),
+            db.bookings.find_one({"id": booking_id})
+        )
         if not employee:
             raise HTTPException(
                 status_code=404, 
                 detail="Assigned employee not found or is not an employee"
             )
-        update_data["assigned_employee_id"] = booking_update.assigned_employee_id
-
-    await db.bookings.update_one({"id": booking_id}, {"$set": update_data})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        async with employee_lock(booking_update.assigned_employee_id):
+            if booking_update.status != "cancelled" and await has_schedule_conflict(current, booking_update.assigned_employee_id):
+                raise HTTPException(status_code=409, detail="Employee not available for this time slot")
+            result = await transition_booking(
+                booking_id, booking_update.status,
+                extra={"assigned_employee_id": booking_update.assigned_employee_id},
+                guard={"assigned_employee_id": current.get("assigned_employee_id")}
+            )
+    if result is None:
+        raise await transition_failed(booking_id, booking_update.status)
+    booking, _ = result
     
     if booking_update.status == "confirmed":
         await notification_manager.notify_booking_confirmed(
@@ -736,98 +2486,65 @@ async def update_booking_status(
 
 @api_router.delete("/bookings/{booking_id}")
 async def delete_booking(booking_id: str, current_user: User = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id, "user_id": current_user.id})
+    booking = await db.bookings.find_one_and_delete({"id": booking_id, "user_id": current_user.id})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
-    await db.bookings.delete_one({"id": booking_id})
+    await booking_changed(booking, None)
     return {"message": "Booking deleted successfully"}
 
 @api_router.delete("/admin/bookings/{booking_id}")
 async def admin_delete_booking(booking_id: str, current_user: User = Depends(get_current_admin)):
     """Permite a los administradores eliminar cualquier reserva"""
-    booking = await db.bookings.find_one({"id": booking_id})
+    booking = await db.bookings.find_one_and_delete({"id": booking_id})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    logger.info(f"Admin {current_user.id} ({current_user.email}) eliminando reserva {booking_id}")
+    logger.info(f"Admin {current_user.id} ({current_user.email}) eliminó la reserva {booking_id}")
     
-    await db.bookings.delete_one({"id": booking_id})
+    await booking_changed(booking, None)
     return {"message": "Booking deleted successfully", "success": True}
 
 @api_router.delete("/bookings/{booking_id}/admin")
 async def delete_booking_admin(booking_id: str, current_user: User = Depends(get_current_admin)):
     """Endpoint alternativo para que los admins eliminen reservas"""
-    booking = await db.bookings.find_one({"id": booking_id})
+    booking = await db.bookings.find_one_and_delete({"id": booking_id})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    await db.bookings.delete_one({"id": booking_id})
+    await booking_changed(booking, None)
     return {"message": "Booking deleted successfully", "success": True}
 
 # User endpoints
+async def build_users(users: List[Dict]) -> List[User]:
+    return [build_user(user) for user in users]
+
+async def build_employees(employees: List[Dict]) -> List[User]:
+    return [build_user(employee, default_role="employee") for employee in employees]
+
 @api_router.get("/users")
-async def get_all_users(current_user: User = Depends(get_current_admin)):
-    users = await db.users.find().to_list(1000)
-    user_list = []
-    for user in users:
-        user_data = {
-            "id": user["id"],
-            "username": user.get("username", user["email"]),
-            "email": user["email"],
-            "full_name": user.get("full_name", ""),
-            "phone": user.get("phone", ""),
-            "role": user.get("role", "customer"),
-            "hashed_password": user["hashed_password"],
-            "is_active": user.get("is_active", True),
-            "created_at": user.get("created_at", datetime.utcnow()),
-            "document_number": user.get("document_number"),
-            "profile_picture_url": user.get("profile_picture_url")
-        }
-        user_list.append(User(**user_data))
-    return user_list
+async def get_all_users(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_admin)
+):
+    return await list_response(db.users, {}, build_users, limit, cursor, stream)
 
 @api_router.get("/users/employees")
-async def get_employees(current_user: User = Depends(get_current_admin)):
-    employees = await db.users.find({"role": "employee"}).to_list(1000)
-    employee_list = []
-    for employee in employees:
-        employee_data = {
-            "id": employee["id"],
-            "username": employee.get("username", employee["email"]),
-            "email": employee["email"],
-            "full_name": employee.get("full_name", ""),
-            "phone": employee.get("phone", ""),
-            "role": employee.get("role", "employee"),
-            "hashed_password": employee["hashed_password"],
-            "is_active": employee.get("is_active", True),
-            "created_at": employee.get("created_at", datetime.utcnow()),
-            "document_number": employee.get("document_number"),
-            "profile_picture_url": employee.get("profile_picture_url")
-        }
-        employee_list.append(User(**employee_data))
-    return employee_list
+async def get_employees(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_admin)
+):
+    return await list_response(db.users, {"role": "employee"}, build_employees, limit, cursor, stream)
 
 @api_router.get("/users/{user_id}")
 async def get_user(user_id: str):
     user = await db.users.find_one({"id": user_id})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    user_data = {
-        "id": user["id"],
-        "username": user.get("username", user["email"]),
-        "email": user["email"],
-        "full_name": user.get("full_name", ""),
-        "phone": user.get("phone", ""),
-        "role": user.get("role", "customer"),
-        "hashed_password": user["hashed_password"],
-        "is_active": user.get("is_active", True),
-        "created_at": user.get("created_at", datetime.utcnow()),
-        "document_number": user.get("document_number"),
-        "profile_picture_url": user.get("profile_picture_url")
-    }
-    
-    return User(**user_data)
+    return build_user(user)
 
 @api_router.put("/admin/users/{user_id}/role")
 async def update_user_role(user_id: str, role_data: dict, current_user: User = Depends(get_current_admin)):
@@ -836,16 +2553,18 @@ async def update_user_role(user_id: str, role_data: dict, current_user: User = D
         raise HTTPException(status_code=400, detail="Invalid role")
     
     await db.users.update_one({"id": user_id}, {"$set": {"role": role}})
+    await publish_user_invalidation(user_id=user_id)
     return {"message": "User role updated successfully"}
 
 @api_router.delete("/admin/users/{user_id}")
 async def delete_user(user_id: str, current_user: User = Depends(get_current_admin)):
-    user = await db.users.find_one({"id": user_id})
+    user = await db.users.find_one_and_delete({"id": user_id, "email": {"$ne": "admin@cleaningservice.com"}})
     if not user:
+        if await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1}):
+            raise HTTPException(status_code=403, detail="Cannot delete main admin user")
         raise HTTPException(status_code=404, detail="User not found")
-    if user["email"] == "admin@cleaningservice.com":
-        raise HTTPException(status_code=403, detail="Cannot delete main admin user")
-    await db.users.delete_one({"id": user_id})
+    await record_user_stats(-1)
+    await publish_user_invalidation(user_id=user_id, email=user["email"])
     return {"message": "User deleted successfully"}
 
 # Payment endpoints
@@ -860,7 +2579,8 @@ async def create_checkout_session(
         raise HTTPException(status_code=404, detail="Booking not found")
     
     try:
-        session = stripe.checkout.Session.create(
+        session = await run_stripe_call(
+            stripe.checkout.Session.create,
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -884,32 +2604,103 @@ async def create_checkout_session(
             {"id": data.booking_id}, 
             {"$set": {"payment_session_id": session.id}}
         )
+        transaction = PaymentTransaction(
+            booking_id=data.booking_id,
+            user_id=current_user.id,
+            session_id=session.id,
+            amount=booking['total_amount'],
+            metadata={"booking_id": data.booking_id, "user_id": current_user.id}
+        )
+        await db.payment_transactions.insert_one(transaction.dict())
         return {"url": session.url, "session_id": session.id}
     except Exception as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
 
+# Estados de sesión de Stripe que ya no cambian
+FINAL_CHECKOUT_STATUSES = {"complete", "expired"}
+
+async def store_checkout_session(session) -> Dict:
+    """Guarda en payment_transactions el estado de una sesión de Stripe"""
+    metadata = dict(session.get("metadata") or {})
+    update = {
+        "payment_status": session.get("payment_status"),
+        "status": session.get("status"),
+        "currency": session.get("currency") or "usd",
+        "updated_at": datetime.utcnow()
+    }
+    if session.get("amount_total") is not None:
+        update["amount"] = session["amount_total"] / 100
+    on_insert = {
+        "id": str(uuid.uuid4()),
+        "booking_id": metadata.get("booking_id", ""),
+        "user_id": metadata.get("user_id", ""),
+        "metadata": metadata,
+        "created_at": datetime.utcnow()
+    }
+    if "amount" not in update:
+        on_insert["amount"] = 0
+    return await db.payment_transactions.find_one_and_update(
+        {"session_id": session["id"]},
+        {"$set": update, "$setOnInsert": on_insert},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+def checkout_status_response(transaction: Dict) -> Dict:
+    return {
+        "payment_status": transaction.get("payment_status"),
+        "status": transaction.get("status"),
+        "amount_total": transaction.get("amount") or 0,
+        "currency": transaction.get("currency")
+    }
+
 @api_router.get("/payments/checkout-status/{session_id}")
 async def get_checkout_status(session_id: str, current_user: User = Depends(get_current_user)):
+    """Estado del pago servido desde payment_transactions; consulta Stripe solo si falta o está desactualizado"""
+    transaction = await db.payment_transactions.find_one({"session_id": session_id})
+    if transaction and (
+        transaction.get("status") in FINAL_CHECKOUT_STATUSES
+        or (datetime.utcnow() - transaction.get("updated_at", datetime.min)).total_seconds() < CHECKOUT_STATUS_MAX_AGE_SECONDS
+    ):
+        return checkout_status_response(transaction)
+
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        return {
-            "payment_status": session.payment_status,
-            "status": session.status,
-            "amount_total": session.amount_total / 100 if session.amount_total else 0,
-            "currency": session.currency
-        }
+        session = await run_stripe_call(stripe.checkout.Session.retrieve, id=session_id)
+        transaction = await store_checkout_session(session)
+        return checkout_status_response(transaction)
     except Exception as e:
         return JSONResponse(status_code=400, content={"error": str(e)})
 
+@api_router.post("/payments/webhook")
+async def stripe_webhook(request: Request):
+    """Recibe eventos de Stripe y actualiza payment_transactions"""
+    if not STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhook not configured")
+
+    payload = await request.body()
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, request.headers.get("stripe-signature", ""), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.error(f"Webhook de Stripe inválido: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook")
+
+    if event["type"].startswith("checkout.session."):
+        await store_checkout_session(event["data"]["object"])
+    return {"received": True}
+
 @api_router.get("/payments/stripe-config")
 async def get_stripe_config():
     return {"publishable_key": stripe_publishable_key}
 
-@api_router.get("/reviews", response_model=List[Review])
-async def get_reviews():
-    reviews = await db.reviews.find().to_list(1000)
+async def build_reviews(reviews: List[Dict]) -> List[Review]:
     return [Review(**review) for review in reviews]
 
+@api_router.get("/reviews", response_model=List[Review])
+async def get_reviews(limit: Optional[int] = None, cursor: Optional[str] = None, stream: bool = False):
+    return await list_response(db.reviews, {}, build_reviews, limit, cursor, stream)
+
 @api_router.post("/reviews", response_model=Review)
 async def create_review(review: ReviewCreate, current_user: User = Depends(get_current_user)):
     booking = await db.bookings.find_one({"id": review.booking_id, "user_id": current_user.id})
@@ -925,20 +2716,280 @@ async def create_review(review: ReviewCreate, current_user: User = Depends(get_c
     return new_review
 
 # Admin dashboard
+# Contadores materializados del dashboard, mantenidos con $inc en cada escritura
+DASHBOARD_STATS_ID = "dashboard"
+DASHBOARD_RECONCILE_INTERVAL_SECONDS = float(os.environ.get('DASHBOARD_RECONCILE_INTERVAL_SECONDS', '600'))
+
+def booking_stats_delta(booking: Dict, sign: int) -> Dict[str, float]:
+    delta = {
+        "total_bookings": sign,
+        f"bookings_by_status.{booking.get('status', 'pending')}": sign
+    }
+    if booking.get("status") == "completed":
+        delta["total_revenue"] = sign * (booking.get("total_amount") or 0)
+    return delta
+
+async def record_booking_stats(changes: List[tuple]):
+    """Aplica al documento de estadísticas la diferencia entre el estado anterior y el nuevo de cada reserva.
+
+    `changes` es una lista de (anterior, nuevo); None representa creación o borrado.
+    """
+    inc: Dict[str, float] = {}
+    for old, new in changes:
+        for booking, sign in ((old, -1), (new, 1)):
+            if booking is None:
+                continue
+            for field, value in booking_stats_delta(booking, sign).items():
+                inc[field] = inc.get(field, 0) + value
+    inc = {field: value for field, value in inc.items() if value}
+    await asyncio.gather(update_dashboard_stats(inc), record_booking_rollups(changes))
+
+async def update_dashboard_stats(inc: Dict[str, float]):
+    if not inc:
+        return
+    try:
+        await db.stats.update_one({"_id": DASHBOARD_STATS_ID}, {"$inc": inc}, upsert=True)
+    except PyMongoError as e:
+        # La reconciliación periódica corrige la desviación
+        logger.error(f"No se pudieron actualizar las estadísticas del dashboard: {e}")
+
+async def record_user_stats(delta: int):
+    try:
+        await db.stats.update_one({"_id": DASHBOARD_STATS_ID}, {"$inc": {"total_users": delta}}, upsert=True)
+    except PyMongoError as e:
+        logger.error(f"No se pudieron actualizar las estadísticas del dashboard: {e}")
+
+async def reconcile_dashboard_stats() -> Dict:
+    """Recalcula los contadores desde las colecciones y reemplaza el documento materializado"""
+    by_status = {}
+    total_revenue = 0
+    async for row in db.bookings.aggregate([
+        {"$group": {
+            "_id": "$status",
+            "count": {"$sum": 1},
+            "revenue": {"$sum": "$total_amount"}
+        }}
+    ]):
+        status_name = row["_id"] or "pending"
+        by_status[status_name] = by_status.get(status_name, 0) + row["count"]
+        if status_name == "completed":
+            total_revenue = row["revenue"]
+    stats = {
+        "_id": DASHBOARD_STATS_ID,
+        "total_bookings": sum(by_status.values()),
+        "total_users": await db.users.count_documents({}),
+        "total_revenue": total_revenue,
+        "bookings_by_status": by_status,
+        "reconciled_at": datetime.utcnow()
+    }
+    await db.stats.replace_one({"_id": DASHBOARD_STATS_ID}, stats, upsert=True)
+    return stats
+
+# Rollups de analítica por periodo y servicio
+ANALYTICS_GRANULARITIES = ("day", "week", "month")
+
+def booking_day(booking: Dict) -> Optional[datetime]:
+    booking_date = booking.get("booking_date")
+    if isinstance(booking_date, str):
+        try:
+            booking_date = datetime.fromisoformat(booking_date)
+        except ValueError:
+            return None
+    return booking_date if isinstance(booking_date, datetime) else None
+
+def analytics_bucket(day: datetime, granularity: str) -> str:
+    if granularity == "day":
+        return day.date().isoformat()
+    if granularity == "week":
+        return (day.date() - timedelta(days=day.weekday())).isoformat()
+    return day.strftime("%Y-%m")
+
+def booking_rollup_deltas(booking: Dict, sign: int) -> Dict[tuple, Dict[str, float]]:
+    """Incrementos de una reserva en cada rollup: (granularidad, bucket, service_id) -> {campo: delta}"""
+    day = booking_day(booking)
+    if day is None:
+        return {}
+    fields = {
+        "bookings": sign,
+        f"by_status.{booking.get('status', 'pending')}": sign
+    }
+    if booking.get("status") == "completed":
+        fields["revenue"] = sign * (booking.get("total_amount") or 0)
+    service_id = booking.get("service_id") or ""
+    return {
+        (granularity, analytics_bucket(day, granularity), service_id): fields
+        for granularity in ANALYTICS_GRANULARITIES
+    }
+
+async def record_booking_rollups(changes: List[tuple]):
+    """Aplica los cambios de reservas a los rollups con un único bulk_write"""
+    deltas: Dict[tuple, Dict[str, float]] = {}
+    for old, new in changes:
+        for booking, sign in ((old, -1), (new, 1)):
+            if booking is None:
+                continue
+            for key, fields in booking_rollup_deltas(booking, sign).items():
+                merged = deltas.setdefault(key, {})
+                for field, value in fields.items():
+                    merged[field] = merged.get(field, 0) + value
+    operations = []
+    for (granularity, bucket, service_id), fields in deltas.items():
+        inc = {field: value for field, value in fields.items() if value}
+        if inc:
+            operations.append(UpdateOne(
+                {"granularity": granularity, "bucket": bucket, "service_id": service_id},
+                {"$inc": inc},
+                upsert=True
+            ))
+    if not operations:
+        return
+    try:
+        await db.booking_rollups.bulk_write(operations, ordered=False)
+    except PyMongoError as e:
+        logger.error(f"No se pudieron actualizar los rollups de analítica: {e}")
+
+ROLLUPS_REBUILD_LOCK_SECONDS = int(os.environ.get('ROLLUPS_REBUILD_LOCK_SECONDS', '600'))
+# Los $inc que llegan durante una reconstrucción se pierden con el rename; la
+# reconstrucción periódica corrige esa deriva igual que reconcile_dashboard_stats
+ROLLUPS_REBUILD_INTERVAL_SECONDS = float(os.environ.get('ROLLUPS_REBUILD_INTERVAL_SECONDS', '3600'))
+
+async def rebuild_booking_rollups() -> int:
+    """Reconstruye los rollups recorriendo bookings; la memoria depende del número de buckets, no de reservas.
+
+    Se escribe en una colección temporal que sustituye a booking_rollups con un
+    rename atómico, así las lecturas nunca ven los rollups vacíos o a medias.
+    """
+    rollups: Dict[tuple, Dict[str, float]] = {}
+    projection = {"_id": 0, "booking_date": 1, "status": 1, "total_amount": 1, "service_id": 1}
+    async for booking in db.bookings.find({}, projection):
+        for key, fields in booking_rollup_deltas(booking, 1).items():
+            merged = rollups.setdefault(key, {})
+            for field, value in fields.items():
+                merged[field] = merged.get(field, 0) + value
+    documents = []
+    for (granularity, bucket, service_id), fields in rollups.items():
+        document = {"granularity": granularity, "bucket": bucket, "service_id": service_id, "by_status": {}}
+        for field, value in fields.items():
+            if field.startswith("by_status."):
+                document["by_status"][field.split(".", 1)[1]] = value
+            else:
+                document[field] = value
+        documents.append(document)
+    staging = db[f"booking_rollups_rebuild_{uuid.uuid4().hex}"]
+    try:
+        await staging.create_indexes(REQUIRED_INDEXES["booking_rollups"])
+        if documents:
+            await staging.insert_many(documents, ordered=False)
+        await staging.rename("booking_rollups", dropTarget=True)
+    except Exception:
+        await staging.drop()
+        raise
+    return len(documents)
+
+async def rebuild_booking_rollups_locked() -> Optional[int]:
+    """Reconstruye los rollups si ningún otro worker lo está haciendo; None si el lock está ocupado"""
+    token = await acquire_lock("rebuild_booking_rollups", ROLLUPS_REBUILD_LOCK_SECONDS)
+    if not token:
+        return None
+    try:
+        return await rebuild_booking_rollups()
+    finally:
+        await release_lock("rebuild_booking_rollups", token)
+
+async def run_periodically(interval_seconds: float, job, name: str):
+    """Ejecuta un trabajo de mantenimiento cada interval_seconds, registrando los errores"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Error en tarea periódica {name}: {e!r}")
+
 @api_router.get("/admin/dashboard")
 async def get_admin_dashboard(current_user: User = Depends(get_current_admin)):
-    total_bookings = await db.bookings.count_documents({})
-    total_users = await db.users.count_documents({})
-    total_revenue = await db.bookings.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
-    ]).to_list(1)
-    pending_bookings = await db.bookings.count_documents({"status": "pending"})
+    stats = await db.stats.find_one({"_id": DASHBOARD_STATS_ID})
+    if stats is None:
+        stats = await reconcile_dashboard_stats()
+    return {
+        "total_bookings": stats.get("total_bookings", 0),
+        "total_users": stats.get("total_users", 0),
+        "total_revenue": stats.get("total_revenue", 0),
+        "pending_bookings": stats.get("bookings_by_status", {}).get("pending", 0)
+    }
+
+@api_router.get("/admin/analytics")
+async def get_booking_analytics(
+    granularity: str = "day",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    service_id: Optional[str] = None,
+    by_service: bool = False,
+    current_user: User = Depends(get_current_admin)
+):
+    """Reservas, ingresos y estados por periodo, leídos de los rollups pre-agregados.
+
+    date_from/date_to son fechas ISO que se comparan con el inicio de cada bucket.
+    """
+    if granularity not in ANALYTICS_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="Invalid granularity")
+
+    match: Dict = {"granularity": granularity}
+    bucket_range = {}
+    try:
+        if date_from:
+            bucket_range["$gte"] = analytics_bucket(datetime.fromisoformat(date_from), granularity)
+        if date_to:
+            bucket_range["$lte"] = analytics_bucket(datetime.fromisoformat(date_to), granularity)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    if bucket_range:
+        match["bucket"] = bucket_range
+    if service_id:
+        match["service_id"] = service_id
+
+    rows = await db.booking_rollups.find(match, {"_id": 0}).sort("bucket", 1).to_list(None)
+    if by_service:
+        service_names = {
+            service["id"]: service["name"]
+            async for service in db.services.find({}, {"_id": 0, "id": 1, "name": 1})
+        }
+        for row in rows:
+            row["service_name"] = service_names.get(row["service_id"])
+        return {"granularity": granularity, "buckets": rows}
+
+    buckets: Dict[str, Dict] = {}
+    for row in rows:
+        bucket = buckets.setdefault(row["bucket"], {"bucket": row["bucket"], "bookings": 0, "revenue": 0, "by_status": {}})
+        bucket["bookings"] += row.get("bookings", 0)
+        bucket["revenue"] += row.get("revenue", 0)
+        for status_name, count in row.get("by_status", {}).items():
+            bucket["by_status"][status_name] = bucket["by_status"].get(status_name, 0) + count
+    return {"granularity": granularity, "buckets": list(buckets.values())}
+
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_booking_analytics(current_user: User = Depends(get_current_admin)):
+    """Reconstruye los rollups de analítica desde la colección bookings"""
+    rollups = await rebuild_booking_rollups_locked()
+    if rollups is None:
+        raise HTTPException(status_code=409, detail="Analytics rebuild already in progress")
+    return {"message": "Analytics rebuilt successfully", "rollups": rollups}
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: User = Depends(get_current_admin)):
+    """Métricas de las cachés en proceso"""
     return {
-        "total_bookings": total_bookings,
-        "total_users": total_users,
-        "total_revenue": total_revenue[0]["total"] if total_revenue else 0,
-        "pending_bookings": pending_bookings
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "services": services_cache.stats()
+    }
+
+@api_router.get("/admin/metrics")
+async def get_runtime_metrics(current_user: User = Depends(get_current_admin)):
+    """Métricas de ejecución del proceso"""
+    return {
+        "password_hashing": password_pool_stats(),
+        "websockets": notification_manager.stats(),
+        "employee_schedule": employee_schedule.stats()
     }
 
 @api_router.post("/simulate-new-booking")
@@ -958,19 +3009,10 @@ async def simulate_booking_confirmed(data: dict):
         booking_id = data.get("booking_id")
         employee_id = data.get("employee_id")
 
-        if employee_id:
-            await db.bookings.update_one(
-                {"id": booking_id}, 
-                {"$set": {"status": "confirmed", "assigned_employee_id": employee_id}}
-            )
-        else:
-            await db.bookings.update_one(
-                {"id": booking_id}, 
-                {"$set": {"status": "confirmed"}}
-            )
-
-        booking = await db.bookings.find_one({"id": booking_id})
-        if booking:
+        extra = {"assigned_employee_id": employee_id} if employee_id else None
+        result = await transition_booking(booking_id, "confirmed", extra=extra)
+        if result:
+            booking, _ = result
             await notification_manager.notify_booking_confirmed(
                 user_id=booking["user_id"],
                 booking_data={"id": booking_id}
@@ -980,6 +3022,94 @@ async def simulate_booking_confirmed(data: dict):
         logger.error(f"Error en simulación de confirmación: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+# Índices requeridos por colección (nombre explícito para poder reconciliarlos)
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+    ],
+    "bookings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("assigned_employee_id", ASCENDING), ("booking_date", ASCENDING)], name="assigned_employee_id_booking_date"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "services": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("is_active", ASCENDING)], name="is_active"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "notifications": [
+        IndexModel([("user_id", ASCENDING), ("seq", ASCENDING)], name="user_id_seq_unique", unique=True),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=NOTIFICATION_REPLAY_TTL_SECONDS),
+    ],
+    "notification_sequences": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "employee_feeds": [
+        IndexModel([("employee_id", ASCENDING)], name="employee_id_unique", unique=True),
+    ],
+    "booking_rollups": [
+        IndexModel(
+            [("granularity", ASCENDING), ("bucket", ASCENDING), ("service_id", ASCENDING)],
+            name="granularity_bucket_service_unique",
+            unique=True
+        ),
+    ],
+    "reviews": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("booking_id", ASCENDING)], name="booking_id"),
+    ],
+}
+
+async def ensure_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """Crea de forma idempotente los índices declarados y reporta los que faltan o sobran.
+
+    Los índices extra no se eliminan: solo se registran para revisión manual.
+    """
+    report = {}
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = {index.document["name"] for index in indexes}
+        missing = [index for index in indexes if index.document["name"] not in existing]
+        extra = sorted(name for name in existing if name != "_id_" and name not in declared)
+
+        failed = []
+        for index in missing:
+            try:
+                await collection.create_indexes([index])
+            except PyMongoError as e:
+                failed.append(index.document["name"])
+                logger.error(f"No se pudo crear el índice {collection_name}.{index.document['name']}: {e}")
+
+        created = [index.document["name"] for index in missing if index.document["name"] not in failed]
+        if created:
+            logger.info(f"Índices creados en {collection_name}: {created}")
+        if extra:
+            logger.warning(f"Índices no declarados en {collection_name}: {extra}")
+        report[collection_name] = {"created": created, "failed": failed, "extra": extra}
+    return report
+
+async def seed_user(user_doc: Dict) -> bool:
+    """Crea el usuario solo si no existe su email; seguro con varios workers arrancando a la vez.
+
+    Si el usuario existe (aunque se le haya cambiado el rol) no se modifica.
+    """
+    try:
+        result = await db.users.update_one(
+            {"email": user_doc["email"]},
+            {"$setOnInsert": user_doc},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Otro worker lo insertó entre la comprobación y el upsert
+        return False
+    return result.upserted_id is not None
+
 async def initialize_default_data():
     """Inicializa datos por defecto: servicios y usuarios admin/empleado"""
     
@@ -1022,9 +3152,7 @@ async def initialize_default_data():
 
     # Crear usuario administrador por defecto
     admin_email = "admin@cleaningservice.com"
-    admin_exists = await db.users.find_one({"email": admin_email, "role": "admin"})
-    
-    if not admin_exists:
+    if not await db.users.find_one({"email": admin_email}, {"_id": 0, "id": 1}):
         admin_user = {
             "id": str(uuid.uuid4()),
             "username": "admin",
@@ -1032,17 +3160,16 @@ async def initialize_default_data():
             "full_name": "Administrador",
             "phone": "555-0123",
             "role": "admin",
-            "hashed_password": get_password_hash("admin123"),
+            "hashed_password": await get_password_hash("admin123"),
             "is_active": True,
             "created_at": datetime.utcnow()
         }
-        await db.users.insert_one(admin_user)
-        logger.info("Usuario administrador creado")
+        if await seed_user(admin_user):
+            logger.info("Usuario administrador creado")
 
     # Crear empleado de prueba
     employee_email = "empleado@cleaningservice.com"
-    employee_exists = await db.users.find_one({"email": employee_email, "role": "employee"})
-    if not employee_exists:
+    if not await db.users.find_one({"email": employee_email}, {"_id": 0, "id": 1}):
         employee_user = {
             "id": str(uuid.uuid4()),
             "username": "empleado1",
@@ -1050,23 +3177,50 @@ async def initialize_default_data():
             "full_name": "Juan Pérez",
             "phone": "3001234567",
             "role": "employee",
-            "hashed_password": get_password_hash("empleado123"),
+            "hashed_password": await get_password_hash("empleado123"),
             "is_active": True,
             "created_at": datetime.utcnow(),
             "document_number": "123456789",
             "profile_picture_url": "https://images.unsplash.com/photo-1599566150163-29194dcaad36"
         }
-        await db.users.insert_one(employee_user)
-        logger.info("Usuario empleado creado")
+        if await seed_user(employee_user):
+            logger.info("Usuario empleado creado")
 
 # Event handlers
+maintenance_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup_event():
+    await ensure_indexes()
     await initialize_default_data()
+    await notification_manager.start(create_notification_bus())
+    await load_employee_schedule()
+    await reconcile_dashboard_stats()
+    # Primer arranque con datos previos: poblar los rollups de analítica
+    # El lock evita que todos los workers lo reconstruyan a la vez; un fallo no impide arrancar
+    if await db.booking_rollups.estimated_document_count() == 0 and await db.bookings.estimated_document_count() > 0:
+        try:
+            await rebuild_booking_rollups_locked()
+        except PyMongoError as e:
+            logger.error(f"No se pudieron reconstruir los rollups de analítica: {e}")
+    maintenance_tasks.append(asyncio.create_task(
+        run_periodically(DASHBOARD_RECONCILE_INTERVAL_SECONDS, reconcile_dashboard_stats, "reconcile_dashboard_stats")
+    ))
+    maintenance_tasks.append(asyncio.create_task(
+        run_periodically(EMPLOYEE_SCHEDULE_RELOAD_SECONDS, load_employee_schedule, "load_employee_schedule")
+    ))
+    maintenance_tasks.append(asyncio.create_task(
+        run_periodically(ROLLUPS_REBUILD_INTERVAL_SECONDS, rebuild_booking_rollups_locked, "rebuild_booking_rollups")
+    ))
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for task in maintenance_tasks:
+        task.cancel()
+    await notification_manager.stop()
     client.close()
+    password_executor.shutdown(wait=False)
+    stripe_executor.shutdown(wait=False)
 
 # Include API router
 app.include_router(api_router)
@@ -1078,4 +3232,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link"],
     )
\ No newline at end of file
@@ -10,6 +10,18 @@ import CalidadSoftware from "./pages/CalidadSoftware";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://192.169.100.22:8000';
 const API = '/api';
 
+// Recorre un listado paginado con limit/next_cursor y devuelve todos los elementos
+const fetchAllPages = async (url, limit = 1000) => {
+    const items = [];
+    let cursor = null;
+    do {
+        const response = await axios.get(url, { params: cursor ? { limit, cursor } : { limit } });
+        items.push(...response.data.items);
+        cursor = response.data.next_cursor;
+    } while (cursor);
+    return items;
+};
+
 const AuthContext = React.createContext();
 
 function App() {
@@ -1173,28 +1185,28 @@ function AdminPanel() {
     const fetchData = async () => {
     setLoading(true);
     try {
-        const [bookingsRes, usersRes, servicesRes, employeesRes] = await Promise.all([
-            axios.get(`${API}/bookings/admin`),
-            axios.get(`${API}/users`),
+        const [allBookings, allUsers, servicesRes, allEmployees] = await Promise.all([
+            fetchAllPages(`${API}/bookings/admin`),
+            fetchAllPages(`${API}/users`),
             axios.get(`${API}/services`),
-            axios.get(`${API}/users/employees`)
+            fetchAllPages(`${API}/users/employees`)
         ]);
 
-        setBookings(bookingsRes.data);
-        setUsers(usersRes.data);
+        setBookings(allBookings);
+        setUsers(allUsers);
         setServices(servicesRes.data);
-        setEmployees(employeesRes.data);
+        setEmployees(allEmployees);
 
         // Calcular métricas con estados corregidos
-        const totalRevenue = bookingsRes.data
+        const totalRevenue = allBookings
             .filter(booking => booking.status === 'completed')
             .reduce((sum, booking) => sum + (booking.hourly_rate * booking.total_hours), 0);
 
         setDashboardData({
-            totalBookings: bookingsRes.data.length,
-            totalUsers: usersRes.data.length,
+            totalBookings: allBookings.length,
+            totalUsers: allUsers.length,
             totalRevenue: totalRevenue,
-            pendingBookings: bookingsRes.data.filter(booking => booking.status === 'pending').length
+            pendingBookings: allBookings.filter(booking => booking.status === 'pending').length
         });
 
         setError('');
@@ -4,6 +4,12 @@ export const useWebSocket = (userId, userRole, handlers) => {
   const wsRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
   const reconnectAttemptsRef = useRef(0);
+  // Mayor seq recibido sin huecos: al reconectar el servidor reenvía lo posterior
+  const lastSeenRef = useRef(null);
+  // Seqs recientes ya entregados; el servidor no garantiza el orden, así que se
+  // deduplica por conjunto y no por el máximo
+  const seenSeqsRef = useRef(new Set());
+  const maxSeenSeqs = 500;
   const maxReconnectAttempts = 5;
   const getWebSocketUrl = () => {
   const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -11,6 +17,23 @@ export const useWebSocket = (userId, userRole, handlers) => {
   return wsHost.replace(/^https?:/, wsProtocol.replace(':', ''));
 };
 
+  // Devuelve false si el seq ya se entregó; si no, lo registra y avanza lastSeen
+  const markSeen = (seq) => {
+    const seen = seenSeqsRef.current;
+    if (seen.has(seq)) return false;
+    seen.add(seq);
+    if (seen.size > maxSeenSeqs) {
+      seen.delete(seen.values().next().value);
+    }
+    if (lastSeenRef.current === null) {
+      lastSeenRef.current = seq - 1;
+    }
+    while (seen.has(lastSeenRef.current + 1)) {
+      lastSeenRef.current += 1;
+    }
+    return true;
+  };
+
   const connect = () => {
     if (!userId || !userRole) {
       console.warn('No userId or userRole provided for WebSocket connection');
@@ -19,7 +42,11 @@ export const useWebSocket = (userId, userRole, handlers) => {
 
     try {
       const token = localStorage.getItem('token');
-      const wsUrl = `${getWebSocketUrl()}/ws/${userId}${token ? `?token=${token}` : ''}`;
+      const params = new URLSearchParams();
+      if (token) params.set('token', token);
+      if (lastSeenRef.current !== null) params.set('last_seen', lastSeenRef.current);
+      const query = params.toString();
+      const wsUrl = `${getWebSocketUrl()}/ws/${userId}${query ? `?${query}` : ''}`;
       
       console.log('Connecting to WebSocket:', wsUrl);
       wsRef.current = new WebSocket(wsUrl);
@@ -33,6 +60,25 @@ export const useWebSocket = (userId, userRole, handlers) => {
       wsRef.current.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+
+          // Heartbeat del servidor: responder sin notificar a la UI
+          if (data.type === 'ping') {
+            wsRef.current?.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
+
+          // Varias notificaciones agrupadas por el servidor en un solo frame
+          if (data.type === 'notification_batch') {
+            (data.notifications || []).forEach((item) => {
+              if (typeof item.seq === 'number' && !markSeen(item.seq)) return;
+              handlers?.notification?.(item);
+            });
+            return;
+          }
+
+          // Descarta duplicados entre el reenvío y los mensajes en vivo
+          if (typeof data.seq === 'number' && !markSeen(data.seq)) return;
+
           console.log('WebSocket message received:', data);
           
           if (data.type === 'notification') {
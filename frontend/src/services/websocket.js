@@ -52,9 +52,20 @@ class WebSocketService {
       this.ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+
+          // Heartbeat del servidor: responder sin notificar a los suscriptores
+          if (data.type === 'ping') {
+            this.ws?.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
+
           console.log('WebSocket JSON Message Received:', data);
           
-          if (data.type) {
+          if (data.type === 'notification_batch') {
+            (data.notifications || []).forEach((item) => {
+              this.notifySubscribers(item.type || 'notification', item);
+            });
+          } else if (data.type) {
             this.notifySubscribers(data.type, data);
           } else {
             this.notifySubscribers('notification', data);
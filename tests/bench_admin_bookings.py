@@ -0,0 +1,123 @@
+"""Benchmark del enriquecimiento de GET /api/bookings/admin: por fila frente a por lotes.
+
+Uso (desde la raíz del repositorio, con un Mongo accesible en MONGO_URL):
+
+    MONGO_URL=mongodb://localhost:27017 python -m tests.bench_admin_bookings --bookings 1000
+
+Siembra N reservas en una base de datos temporal y compara la implementación
+anterior (find_one de usuario, empleado y servicio por reserva) con
+enrich_bookings(..., "admin"), contando los comandos enviados a Mongo y la
+latencia. La base de datos se elimina al terminar.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from tests import conftest  # noqa: F401  (configura el entorno para importar server)
+import server
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate", "getMore"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def legacy_admin_bookings(db):
+    """Implementación anterior: hasta tres find_one por reserva"""
+    bookings = await db.bookings.find().to_list(1000)
+    enriched_bookings = []
+    for booking in bookings:
+        booking = server.serialize_objectid(booking)
+        if not booking.get("service_name") and booking.get("service_id"):
+            service = await db.services.find_one({"id": booking["service_id"]})
+            if service:
+                booking["service_name"] = service["name"]
+        user = await db.users.find_one({"id": booking["user_id"]})
+        booking["full_name"] = user.get("full_name", "Usuario Desconocido") if user else "Usuario Desconocido"
+        if booking.get("assigned_employee_id"):
+            employee = await db.users.find_one({"id": booking["assigned_employee_id"]})
+            if employee:
+                booking["employee_full_name"] = employee.get("full_name")
+                booking["employee_phone"] = employee.get("phone")
+        enriched_bookings.append(booking)
+    return enriched_bookings
+
+
+async def batched_admin_bookings(db):
+    bookings = await db.bookings.find().to_list(1000)
+    return await server.enrich_bookings(bookings, "admin")
+
+
+async def seed(db, bookings: int, rng: random.Random):
+    customers = [{"id": str(uuid.uuid4()), "full_name": f"Cliente {i}", "role": "customer"} for i in range(200)]
+    employees = [{"id": str(uuid.uuid4()), "full_name": f"Empleado {i}", "phone": "300", "role": "employee"} for i in range(20)]
+    services = [{"id": str(uuid.uuid4()), "name": f"Servicio {i}"} for i in range(5)]
+    await db.users.insert_many(customers + employees)
+    await db.services.insert_many(services)
+    await db.bookings.insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": rng.choice(customers)["id"],
+            "service_id": rng.choice(services)["id"],
+            "assigned_employee_id": rng.choice(employees)["id"] if rng.random() < 0.7 else None,
+            "booking_date": "2026-03-02",
+            "start_time": "09:00",
+            "end_time": "11:00",
+            "status": "pending",
+        }
+        for _ in range(bookings)
+    ])
+    await db.users.create_index("id", unique=True)
+    await db.services.create_index("id", unique=True)
+
+
+async def measure(name, func, db, counter, runs):
+    latencies = []
+    for _ in range(runs):
+        counter.count = 0
+        started = time.perf_counter()
+        result = await func(db)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(f"{name:>8}: {len(result)} reservas, {counter.count} consultas, "
+          f"mediana {latencies[len(latencies) // 2] * 1000:.1f} ms, máx {latencies[-1] * 1000:.1f} ms")
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(server.mongo_url, event_listeners=[counter])
+    db = client[f"bench_admin_bookings_{uuid.uuid4().hex[:8]}"]
+    server.db = db
+    try:
+        await seed(db, args.bookings, random.Random(1))
+        before = await measure("antes", legacy_admin_bookings, db, counter, args.runs)
+        after = await measure("después", batched_admin_bookings, db, counter, args.runs)
+        assert before == after, "las dos implementaciones devuelven resultados distintos"
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""Benchmark de la agenda de empleados (EmployeeSchedule) frente a un recorrido lineal.
+
+Uso (desde la raíz del repositorio):
+
+    python -m tests.bench_employee_schedule --employees 5000 --bookings 100000
+
+No necesita Mongo: compara "¿está libre?" y "¿quién está libre?" sobre el índice
+en memoria con la búsqueda lineal sobre todas las reservas del empleado, que es
+lo que haría una comprobación sin índice.
+"""
+import argparse
+import random
+import time
+
+from tests import conftest  # noqa: F401  (configura el entorno para importar server)
+from server import EmployeeSchedule, plan_assignments
+import server
+
+DAYS = [f"2026-03-{day:02d}" for day in range(1, 29)]
+
+
+def random_interval(rng):
+    start = rng.randrange(6 * 60, 20 * 60, 15)
+    return start, start + rng.choice([60, 90, 120, 180])
+
+
+def linear_is_free(by_employee, employee_id, day, start, end):
+    return not any(
+        d == day and s < end and start < f
+        for d, s, f in by_employee.get(employee_id, ())
+    )
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--bookings", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=21)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    employees = [f"e{i}" for i in range(args.employees)]
+    bookings = [
+        (f"b{i}", rng.choice(employees), rng.choice(DAYS), *random_interval(rng))
+        for i in range(args.bookings)
+    ]
+
+    schedule = EmployeeSchedule()
+    _, build_time = timed(lambda: [schedule.add(*booking) for booking in bookings])
+    by_employee = {}
+    for _, employee_id, day, start, end in bookings:
+        by_employee.setdefault(employee_id, []).append((day, start, end))
+
+    queries = [(rng.choice(employees), rng.choice(DAYS), *random_interval(rng)) for _ in range(args.queries)]
+    indexed, indexed_time = timed(lambda: [schedule.is_free(*query) for query in queries])
+    linear, linear_time = timed(lambda: [linear_is_free(by_employee, *query) for query in queries])
+    assert indexed == linear, "el índice y el recorrido lineal no coinciden"
+
+    slots = queries[:200]
+    _, free_indexed_time = timed(lambda: [schedule.free_employees(employees, day, s, f) for _, day, s, f in slots])
+    _, free_linear_time = timed(lambda: [
+        [employee_id for employee_id in employees if linear_is_free(by_employee, employee_id, day, s, f)]
+        for _, day, s, f in slots
+    ])
+
+    server.employee_schedule = schedule
+    pending = [
+        {"id": f"p{i}", "booking_date": rng.choice(DAYS[:7]),
+         "start_time": f"{s // 60:02d}:{s % 60:02d}", "end_time": f"{f // 60:02d}:{f % 60:02d}"}
+        for i, (s, f) in enumerate(random_interval(rng) for _ in range(min(args.bookings // 10, 10000)))
+    ]
+    plan, plan_time = timed(lambda: plan_assignments(pending, employees, DAYS[0], DAYS[6]))
+
+    print(f"empleados={args.employees} reservas={args.bookings} consultas={args.queries}")
+    print(f"construcción del índice: {build_time * 1000:.1f} ms")
+    print(f"is_free      índice: {indexed_time / args.queries * 1e6:8.2f} µs/consulta   "
+          f"lineal: {linear_time / args.queries * 1e6:8.2f} µs/consulta")
+    print(f"free_employees índice: {free_indexed_time / len(slots) * 1000:8.2f} ms/franja   "
+          f"lineal: {free_linear_time / len(slots) * 1000:8.2f} ms/franja")
+    print(f"plan_assignments: {len(plan)}/{len(pending)} asignadas en {plan_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+# server.py lee su configuración del entorno al importarse; estos valores solo
+# permiten importarlo (Motor no conecta hasta la primera operación)
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "proyecto_limpieza_test")
+os.environ.setdefault("STRIPE_API_KEY", "sk_test_dummy")
+os.environ.setdefault("STRIPE_PUBLISHABLE_KEY", "pk_test_dummy")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import pytest_asyncio  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def mock_db(monkeypatch):
+    """Base de datos en memoria (mongomock) en lugar de la de server.db"""
+    import server
+
+    database = AsyncMongoMockClient()[os.environ["DB_NAME"]]
+    monkeypatch.setattr(server, "db", database)
+    yield database
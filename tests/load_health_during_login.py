@@ -0,0 +1,117 @@
+"""Prueba de carga: latencia p99 de /health durante una ráfaga de logins.
+
+Uso (desde la raíz del repositorio, con un Mongo accesible en MONGO_URL):
+
+    MONGO_URL=mongodb://localhost:27017 python -m tests.load_health_during_login --logins 200
+
+Ejecuta la app en proceso (httpx + ASGITransport) contra una base de datos
+temporal y mide /health mientras se lanzan logins concurrentes, dos veces:
+
+- antes: bcrypt se ejecuta directamente en el event loop, como hacían login y
+  register antes de usar el pool (se simula sustituyendo run_password_job);
+- después: bcrypt va al pool acotado (PASSWORD_HASH_WORKERS).
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from tests import conftest  # noqa: F401  (configura el entorno para importar server)
+import server
+
+EMAIL = "carga@cleaningservice.com"
+PASSWORD = "carga123"
+
+
+async def inline_password_job(func, *args):
+    """Comportamiento anterior: bcrypt bloquea el event loop"""
+    return func(*args)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(client: httpx.AsyncClient, logins: int, concurrency: int, interval: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+    done = asyncio.Event()
+
+    async def login():
+        nonlocal failures
+        async with semaphore:
+            response = await client.post("/api/auth/login", data={"username": EMAIL, "password": PASSWORD})
+            if response.status_code != 200:
+                failures += 1
+
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            await client.get("/health")
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(interval)
+
+    prober = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await prober
+    return {
+        "logins_per_second": logins / elapsed,
+        "failures": failures,
+        "samples": len(latencies),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def report(name: str, result: dict):
+    print(
+        f"{name:>8}: {result['logins_per_second']:.1f} logins/s ({result['failures']} fallidos), "
+        f"/health p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+        f"máx {result['max_ms']:.1f} ms ({result['samples']} muestras)"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.01, help="pausa entre sondas de /health (s)")
+    args = parser.parse_args()
+
+    db = server.client[f"load_health_{uuid.uuid4().hex[:8]}"]
+    server.db = db
+    await db.users.insert_one({
+        "id": str(uuid.uuid4()),
+        "email": EMAIL,
+        "full_name": "Carga",
+        "role": "customer",
+        "is_active": True,
+        "hashed_password": server.pwd_context.hash(PASSWORD),
+    })
+
+    transport = httpx.ASGITransport(app=server.app)
+    pooled_job = server.run_password_job
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            server.run_password_job = inline_password_job
+            report("antes", await run(client, args.logins, args.concurrency, args.interval))
+            server.run_password_job = pooled_job
+            report("después", await run(client, args.logins, args.concurrency, args.interval))
+            print(f"pool: {server.password_pool_stats()}")
+    finally:
+        server.run_password_job = pooled_job
+        await server.client.drop_database(db.name)
+        server.client.close()
+        server.password_executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+import pytest
+
+import server
+
+
+def booking(booking_id, status="completed", amount=50):
+    return {
+        "id": booking_id,
+        "service_id": "s1",
+        "booking_date": "2026-03-02",
+        "status": status,
+        "total_amount": amount,
+    }
+
+
+@pytest.mark.asyncio
+async def test_rebuild_replaces_drifted_rollups(mock_db):
+    await mock_db.bookings.insert_many([booking("b1"), booking("b2", status="pending")])
+    # Un $inc perdido durante una reconstrucción anterior deja el rollup desfasado
+    await mock_db.booking_rollups.insert_one(
+        {"granularity": "day", "bucket": "2026-03-02", "service_id": "s1", "bookings": 1, "by_status": {"completed": 1}}
+    )
+
+    assert await server.rebuild_booking_rollups_locked() == len(server.ANALYTICS_GRANULARITIES)
+
+    day = await mock_db.booking_rollups.find_one({"granularity": "day"}, {"_id": 0})
+    assert day["bookings"] == 2
+    assert day["revenue"] == 50
+    assert day["by_status"] == {"completed": 1, "pending": 1}
+    assert await mock_db.locks.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_rebuild_is_skipped_while_another_worker_holds_the_lock(mock_db):
+    await mock_db.bookings.insert_one(booking("b1"))
+    await server.acquire_lock("rebuild_booking_rollups", 60)
+
+    assert await server.rebuild_booking_rollups_locked() is None
+    assert await mock_db.booking_rollups.count_documents({}) == 0
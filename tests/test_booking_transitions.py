@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+
+import server
+from server import BOOKING_TRANSITIONS, BookingUpdate, User
+
+STATUSES = ["pending", "confirmed", "completed", "cancelled"]
+ALLOWED = {
+    ("pending", "confirmed"),
+    ("pending", "cancelled"),
+    ("confirmed", "confirmed"),
+    ("confirmed", "completed"),
+    ("confirmed", "cancelled"),
+}
+ADMIN = User(username="admin", email="admin@example.com", phone="1", role="admin", hashed_password="x")
+
+
+def booking(status="pending", **fields):
+    return {
+        "id": "b1",
+        "user_id": "c1",
+        "service_id": "s1",
+        "service_name": "Limpieza",
+        "booking_date": "2026-03-02",
+        "start_time": "09:00",
+        "end_time": "11:00",
+        "address": "Calle 1",
+        "status": status,
+        "assigned_employee_id": None,
+        **fields,
+    }
+
+
+@pytest_asyncio.fixture
+async def employees(mock_db):
+    await mock_db.users.insert_many([
+        {"id": "e1", "email": "e1@example.com", "role": "employee", "full_name": "E1"},
+        {"id": "e2", "email": "e2@example.com", "role": "employee", "full_name": "E2"},
+    ])
+
+
+def test_transition_table():
+    assert {(source, target) for source, targets in BOOKING_TRANSITIONS.items() for target in targets} == ALLOWED
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source", STATUSES)
+@pytest.mark.parametrize("target", STATUSES)
+async def test_update_booking_status(mock_db, source, target):
+    await mock_db.bookings.insert_one(booking(source))
+
+    if (source, target) in ALLOWED:
+        result = await server.update_booking_status("b1", BookingUpdate(status=target), current_user=ADMIN)
+        assert result == {"message": "Booking status updated successfully"}
+        stored = await mock_db.bookings.find_one({"id": "b1"})
+        assert stored["status"] == target
+        assert "updated_at" in stored
+    else:
+        with pytest.raises(HTTPException) as error:
+            await server.update_booking_status("b1", BookingUpdate(status=target), current_user=ADMIN)
+        assert error.value.status_code == 409
+        assert error.value.detail == f"Invalid status transition from {source} to {target}"
+        assert (await mock_db.bookings.find_one({"id": "b1"}))["status"] == source
+
+
+@pytest.mark.asyncio
+async def test_unknown_status_is_rejected(mock_db):
+    await mock_db.bookings.insert_one(booking())
+    with pytest.raises(HTTPException) as error:
+        await server.update_booking_status("b1", BookingUpdate(status="archived"), current_user=ADMIN)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_missing_booking_is_404(mock_db):
+    with pytest.raises(HTTPException) as error:
+        await server.update_booking_status("missing", BookingUpdate(status="confirmed"), current_user=ADMIN)
+    assert error.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_transition_guard_rejects_concurrent_change(mock_db):
+    await mock_db.bookings.insert_one(booking("pending", assigned_employee_id="e1"))
+
+    result = await server.transition_booking("b1", "confirmed", extra={"assigned_employee_id": "e2"}, guard={"assigned_employee_id": None})
+    assert result is None
+    error = await server.transition_failed("b1", "confirmed")
+    assert error.status_code == 409
+    assert error.detail == "Booking was modified concurrently"
+
+
+@pytest.mark.asyncio
+async def test_transition_returns_both_images(mock_db):
+    await mock_db.bookings.insert_one(booking())
+
+    old, new = await server.transition_booking("b1", "confirmed", extra={"assigned_employee_id": "e1"})
+    assert old["status"] == "pending" and old["assigned_employee_id"] is None
+    assert new["status"] == "confirmed" and new["assigned_employee_id"] == "e1"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status, expected", [("pending", 200), ("confirmed", 200), ("completed", 409), ("cancelled", 409)])
+async def test_assign_employee_by_status(mock_db, employees, status, expected):
+    await mock_db.bookings.insert_one(booking(status, assigned_employee_id="e2" if status != "pending" else None))
+
+    if expected == 200:
+        result = await server.assign_employee("b1", {"employee_id": "e1"})
+        assert result["success"] is True
+        stored = await mock_db.bookings.find_one({"id": "b1"})
+        assert (stored["status"], stored["assigned_employee_id"]) == ("confirmed", "e1")
+    else:
+        with pytest.raises(HTTPException) as error:
+            await server.assign_employee("b1", {"employee_id": "e1"})
+        assert error.value.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_assign_employee_errors(mock_db, employees):
+    with pytest.raises(HTTPException) as error:
+        await server.assign_employee("b1", {})
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await server.assign_employee("b1", {"employee_id": "nobody"})
+    assert error.value.status_code == 404
+    with pytest.raises(HTTPException) as error:
+        await server.assign_employee("missing", {"employee_id": "e1"})
+    assert error.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_concurrent_assignments_cannot_double_book(mock_db, employees, monkeypatch):
+    await mock_db.bookings.insert_many([booking(id="b1"), booking(id="b2", start_time="10:00", end_time="12:00")])
+    has_schedule_conflict = server.has_schedule_conflict
+
+    async def slow_conflict_check(current, employee_id):
+        # Abre la ventana entre la comprobación y la escritura
+        conflict = await has_schedule_conflict(current, employee_id)
+        await asyncio.sleep(0.01)
+        return conflict
+
+    monkeypatch.setattr(server, "has_schedule_conflict", slow_conflict_check)
+    results = await asyncio.gather(
+        server.assign_employee("b1", {"employee_id": "e1"}),
+        server.assign_employee("b2", {"employee_id": "e1"}),
+        return_exceptions=True
+    )
+
+    errors = [result for result in results if isinstance(result, HTTPException)]
+    assert len(errors) == 1 and errors[0].status_code == 409
+    assert await mock_db.bookings.count_documents({"assigned_employee_id": "e1"}) == 1
+
+
+@pytest.mark.asyncio
+async def test_auto_assign_skips_conflicts_missing_from_local_schedule(mock_db, employees, monkeypatch):
+    # La agenda en memoria está vacía (desfasada): el choque solo existe en Mongo
+    monkeypatch.setattr(server, "employee_schedule", server.EmployeeSchedule())
+    await mock_db.users.delete_one({"id": "e2"})
+    await mock_db.bookings.insert_many([
+        booking("confirmed", id="taken", assigned_employee_id="e1", start_time="10:00", end_time="12:00"),
+        booking(id="overlapping", start_time="09:00", end_time="11:00"),
+        booking(id="free", start_time="13:00", end_time="14:00"),
+    ])
+
+    result = await server.auto_assign_bookings(
+        server.AutoAssignRequest(date_from="2026-03-01", date_to="2026-03-03"), current_user=ADMIN
+    )
+
+    assert result["assignments"] == [{"booking_id": "free", "employee_id": "e1"}]
+    assert result["unassigned"] == ["overlapping"]
+    assert (await mock_db.bookings.find_one({"id": "overlapping"}))["status"] == "pending"
+    assert await mock_db.locks.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_auto_assign_leaves_out_employees_being_assigned(mock_db, employees, monkeypatch):
+    monkeypatch.setattr(server, "employee_schedule", server.EmployeeSchedule())
+    await mock_db.users.delete_one({"id": "e2"})
+    await mock_db.bookings.insert_one(booking())
+    token = await server.acquire_lock("employee:e1", 30)
+
+    result = await server.auto_assign_bookings(
+        server.AutoAssignRequest(date_from="2026-03-01", date_to="2026-03-03"), current_user=ADMIN
+    )
+
+    assert result == {"assigned": 0, "assignments": [], "unassigned": ["b1"]}
+    assert (await mock_db.locks.find_one({"_id": "employee:e1"}))["owner"] == token
@@ -0,0 +1,97 @@
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from starlette.requests import Request
+
+import server
+from server import User
+
+EMPLOYEE = User(id="e1", username="e1@example.com", email="e1@example.com", phone="1", role="employee", hashed_password="x")
+OTHER = User(id="e2", username="e2@example.com", email="e2@example.com", phone="1", role="employee", hashed_password="x")
+
+
+@pytest_asyncio.fixture
+async def employee(mock_db):
+    await mock_db.users.insert_one(
+        {"id": "e1", "email": "e1@example.com", "role": "employee", "hashed_password": "x", "is_active": True}
+    )
+    await mock_db.bookings.insert_one({
+        "id": "b1",
+        "user_id": "c1",
+        "service_name": "Limpieza",
+        "booking_date": "2026-03-02",
+        "start_time": "09:00",
+        "end_time": "11:00",
+        "status": "confirmed",
+        "assigned_employee_id": "e1",
+    })
+
+
+def feed(token=None, credentials=None):
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+    return server.get_employee_assignments_feed(
+        "e1", request, format="ics", date_from="2026-03-01", date_to="2026-03-31",
+        token=token, credentials=credentials
+    )
+
+
+async def rejected(token=None, credentials=None):
+    with pytest.raises(HTTPException) as error:
+        await feed(token, credentials)
+    return error.value.status_code
+
+
+@pytest.mark.asyncio
+async def test_feed_token_grants_access_until_rotated_or_revoked(employee):
+    first = await server.rotate_employee_feed_token("e1", current_user=EMPLOYEE)
+    assert first["url"].endswith(f"/feed?token={first['token']}")
+
+    response = await feed(first["token"])
+    assert "UID:b1@proyecto-limpieza" in response.body.decode()
+
+    second = await server.rotate_employee_feed_token("e1", current_user=EMPLOYEE)
+    assert await rejected(first["token"]) == 401
+    assert (await feed(second["token"])).status_code == 200
+
+    await server.revoke_employee_feed_token("e1", current_user=EMPLOYEE)
+    assert await rejected(second["token"]) == 401
+
+
+@pytest.mark.asyncio
+async def test_feed_token_stops_working_for_inactive_employee(employee, mock_db):
+    issued = await server.rotate_employee_feed_token("e1", current_user=EMPLOYEE)
+    await mock_db.users.update_one({"id": "e1"}, {"$set": {"is_active": False}})
+
+    assert await rejected(issued["token"]) == 401
+
+
+@pytest.mark.asyncio
+async def test_feed_token_is_stored_hashed(employee, mock_db):
+    issued = await server.rotate_employee_feed_token("e1", current_user=EMPLOYEE)
+
+    stored = await mock_db.employee_feeds.find_one({"employee_id": "e1"})
+    assert stored["token_hash"] == server.feed_token_hash(issued["token"])
+    assert issued["token"] not in str(stored)
+
+
+@pytest.mark.asyncio
+async def test_feed_requires_token_or_bearer(employee):
+    assert await rejected() == 401
+    assert await rejected("not-a-token") == 401
+
+
+@pytest.mark.asyncio
+async def test_feed_still_accepts_bearer(employee):
+    bearer = server.create_access_token({"sub": "e1@example.com"})
+
+    response = await feed(credentials=HTTPAuthorizationCredentials(scheme="Bearer", credentials=bearer))
+
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_only_the_employee_or_an_admin_can_issue_tokens(employee):
+    with pytest.raises(HTTPException) as error:
+        await server.rotate_employee_feed_token("e1", current_user=OTHER)
+    assert error.value.status_code == 403
@@ -0,0 +1,144 @@
+import random
+
+import pytest
+
+import server
+from server import EmployeeSchedule, plan_assignments
+
+DAYS = ["2026-03-02", "2026-03-03", "2026-03-04"]
+
+
+def hhmm(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def random_interval(rng):
+    start = rng.randrange(6 * 60, 20 * 60, 15)
+    return start, start + rng.choice([30, 60, 90, 120, 180])
+
+
+def overlaps(a_start, a_end, b_start, b_end):
+    return a_start < b_end and b_start < a_end
+
+
+def brute_is_free(entries, employee_id, day, start, end, exclude=None):
+    return not any(
+        booking_id != exclude and e == employee_id and d == day and overlaps(s, f, start, end)
+        for booking_id, (e, d, s, f) in entries.items()
+    )
+
+
+@pytest.fixture
+def empty_schedule():
+    previous = server.employee_schedule
+    server.employee_schedule = EmployeeSchedule()
+    yield server.employee_schedule
+    server.employee_schedule = previous
+
+
+def test_is_free_matches_brute_force():
+    rng = random.Random(21)
+    schedule = EmployeeSchedule()
+    entries = {}
+    employees = [f"e{i}" for i in range(20)]
+    for i in range(3000):
+        booking_id = f"b{i}"
+        entry = (rng.choice(employees), rng.choice(DAYS), *random_interval(rng))
+        schedule.add(booking_id, *entry)
+        entries[booking_id] = entry
+        # Mover o borrar de vez en cuando para ejercitar remove y el re-add
+        if rng.random() < 0.1:
+            victim = rng.choice(list(entries))
+            if rng.random() < 0.5:
+                schedule.remove(victim)
+                del entries[victim]
+            else:
+                moved = (rng.choice(employees), rng.choice(DAYS), *random_interval(rng))
+                schedule.add(victim, *moved)
+                entries[victim] = moved
+
+    for _ in range(5000):
+        employee_id, day = rng.choice(employees), rng.choice(DAYS)
+        start, end = random_interval(rng)
+        exclude = rng.choice(list(entries)) if rng.random() < 0.3 else None
+        expected = brute_is_free(entries, employee_id, day, start, end, exclude)
+        assert schedule.is_free(employee_id, day, start, end, exclude=exclude) == expected
+    assert schedule.stats()["bookings"] == len(entries)
+
+
+def test_exclude_ignores_only_the_given_booking():
+    schedule = EmployeeSchedule()
+    schedule.add("a", "e1", DAYS[0], 540, 600)
+    schedule.add("b", "e1", DAYS[0], 570, 660)
+
+    assert schedule.is_free("e1", DAYS[0], 540, 600, exclude="a") is False
+    schedule.remove("b")
+    assert schedule.is_free("e1", DAYS[0], 540, 600, exclude="a") is True
+    assert schedule.is_free("e1", DAYS[0], 540, 600, exclude="missing") is False
+
+
+def test_touching_intervals_do_not_overlap():
+    schedule = EmployeeSchedule()
+    schedule.add("a", "e1", DAYS[0], 540, 600)
+
+    assert schedule.is_free("e1", DAYS[0], 600, 660)
+    assert schedule.is_free("e1", DAYS[0], 480, 540)
+    assert not schedule.is_free("e1", DAYS[0], 599, 660)
+
+
+def test_free_employees():
+    schedule = EmployeeSchedule()
+    schedule.add("a", "e1", DAYS[0], 540, 600)
+    schedule.add("b", "e2", DAYS[1], 540, 600)
+
+    assert schedule.free_employees(["e1", "e2", "e3"], DAYS[0], 550, 560) == ["e2", "e3"]
+
+
+def test_plan_assignments_against_brute_force(empty_schedule):
+    rng = random.Random(22)
+    employees = [f"e{i}" for i in range(15)]
+    existing = {}
+    for i in range(200):
+        entry = (rng.choice(employees), rng.choice(DAYS), *random_interval(rng))
+        empty_schedule.add(f"x{i}", *entry)
+        existing[f"x{i}"] = entry
+
+    pending = []
+    for i in range(400):
+        start, end = random_interval(rng)
+        pending.append({
+            "id": f"p{i}",
+            "booking_date": rng.choice(DAYS),
+            "start_time": hhmm(start),
+            "end_time": hhmm(end),
+            "status": "pending",
+        })
+
+    plan = plan_assignments(pending, employees, DAYS[0], DAYS[-1])
+
+    final = dict(existing)
+    by_id = {booking["id"]: booking for booking in pending}
+    for booking_id, employee_id in plan.items():
+        booking = by_id[booking_id]
+        start, end = server.time_to_minutes(booking["start_time"]), server.time_to_minutes(booking["end_time"])
+        assert employee_id in employees
+        assert brute_is_free(final, employee_id, booking["booking_date"], start, end)
+        final[booking_id] = (employee_id, booking["booking_date"], start, end)
+
+    # Voraz por hora de inicio: si una reserva quedó sin asignar, nadie estaba libre
+    for booking in pending:
+        if booking["id"] in plan:
+            continue
+        start, end = server.time_to_minutes(booking["start_time"]), server.time_to_minutes(booking["end_time"])
+        assert not any(
+            brute_is_free(final, employee_id, booking["booking_date"], start, end)
+            for employee_id in employees
+        )
+
+
+def test_plan_assignments_prefers_least_loaded(empty_schedule):
+    empty_schedule.add("x1", "busy", DAYS[0], 420, 450)
+    empty_schedule.add("x2", "busy", DAYS[1], 420, 450)
+    booking = {"id": "p1", "booking_date": DAYS[0], "start_time": "09:00", "end_time": "10:00"}
+
+    assert plan_assignments([booking], ["busy", "idle"], DAYS[0], DAYS[-1]) == {"p1": "idle"}
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import server
+
+
+async def identity(docs):
+    return [{"n": doc["n"]} for doc in docs]
+
+
+@pytest.mark.asyncio
+async def test_flat_list_signals_truncation(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "MAX_PAGE_LIMIT", 2)
+    await mock_db.items.insert_many([{"n": n} for n in range(3)])
+
+    response = await server.list_response(mock_db.items, {}, identity)
+
+    assert json.loads(response.body) == [{"n": 0}, {"n": 1}]
+    cursor = response.headers["X-Next-Cursor"]
+    assert response.headers["Link"] == f'<?limit=2&cursor={cursor}>; rel="next"'
+    page = await server.list_response(mock_db.items, {}, identity, limit=2, cursor=cursor)
+    assert json.loads(page.body) == {"items": [{"n": 2}], "next_cursor": None}
+
+
+@pytest.mark.asyncio
+async def test_flat_list_without_more_items_has_no_cursor(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "MAX_PAGE_LIMIT", 2)
+    await mock_db.items.insert_many([{"n": n} for n in range(2)])
+
+    response = await server.list_response(mock_db.items, {}, identity)
+
+    assert json.loads(response.body) == [{"n": 0}, {"n": 1}]
+    assert "X-Next-Cursor" not in response.headers
@@ -0,0 +1,217 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import ClientConnection
+
+
+class FakeWebSocket:
+    """WebSocket mínimo: guarda lo enviado y permite bloquear los envíos"""
+
+    def __init__(self):
+        self.sent = []
+        self.accepted = False
+        self.close_codes = []
+        self.unblocked = asyncio.Event()
+        self.unblocked.set()
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, payload):
+        await self.unblocked.wait()
+        self.sent.append(payload)
+
+    async def close(self, code=1000):
+        self.close_codes.append(code)
+
+    def frames(self):
+        return [json.loads(payload) for payload in self.sent]
+
+
+async def drain():
+    """Deja correr las tareas de escritura hasta vaciar las colas"""
+    for _ in range(50):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_once(monkeypatch):
+    monkeypatch.setattr(server, "WS_OVERFLOW_POLICY", "disconnect")
+    monkeypatch.setattr(server, "WS_QUEUE_MAX_SIZE", 2)
+    websocket = FakeWebSocket()
+    websocket.unblocked.clear()
+    closed = []
+    connection = ClientConnection(websocket, "u1", on_close=closed.append)
+    connection.start()
+
+    results = [connection.enqueue(f"m{i}") for i in range(6)]
+    await drain()
+
+    assert connection.closed
+    assert results[:2] == [True, True]
+    assert not any(results[2:])
+    assert closed == [connection]
+    assert websocket.close_codes == [server.status.WS_1013_TRY_AGAIN_LATER]
+
+
+@pytest.mark.asyncio
+async def test_per_user_limit_evicts_least_active_session(monkeypatch):
+    monkeypatch.setattr(server, "WS_MAX_CONNECTIONS_PER_USER", 2)
+    manager = server.NotificationManager()
+    sockets = [FakeWebSocket() for _ in range(3)]
+    first = await manager.connect("u1", sockets[0])
+    second = await manager.connect("u1", sockets[1])
+    second.touch()
+    first.last_activity -= 60
+
+    third = await manager.connect("u1", sockets[2])
+
+    assert third is not None
+    assert first.closed and sockets[0].close_codes == [server.status.WS_1000_NORMAL_CLOSURE]
+    assert manager.active_connections["u1"] == {second, third}
+    for connection in (second, third):
+        connection.stop()
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(server, "NOTIFICATION_COALESCE_WINDOW_SECONDS", 0)
+    return server.NotificationManager()
+
+
+def notification(index):
+    return {"type": "notification", "category": "info", "message": f"n{index}"}
+
+
+def seqs(websocket):
+    return [frame["seq"] for frame in websocket.frames()]
+
+
+@pytest.mark.asyncio
+async def test_replay_from_memory_buffer(mock_db, manager):
+    first = FakeWebSocket()
+    connection = await manager.connect("u1", first)
+    for index in range(3):
+        await manager.send_personal_message(notification(index), "u1")
+    await drain()
+    assert seqs(first) == [1, 2, 3]
+
+    manager.disconnect("u1", connection)
+    for index in range(3, 5):
+        await manager.send_personal_message(notification(index), "u1")
+    # Sin Mongo solo puede venir del buffer
+    await mock_db.notifications.delete_many({})
+
+    second = FakeWebSocket()
+    reconnected = await manager.connect("u1", second, last_seen=3)
+    await drain()
+    assert seqs(second) == [4, 5]
+    reconnected.stop()
+
+
+@pytest.mark.asyncio
+async def test_replay_falls_back_to_mongo(mock_db, manager):
+    # Otro worker registró las notificaciones: este no tiene buffer para u1
+    other = server.NotificationManager()
+    for index in range(4):
+        await other.send_personal_message(notification(index), "u1")
+    assert manager.replay_buffers.get("u1") is None
+
+    websocket = FakeWebSocket()
+    connection = await manager.connect("u1", websocket, last_seen=1)
+    await drain()
+    assert seqs(websocket) == [2, 3, 4]
+    connection.stop()
+
+
+@pytest.mark.asyncio
+async def test_no_buffer_for_users_without_local_session(mock_db, manager):
+    await manager.send_personal_message(notification(0), "nobody")
+    assert manager.replay_buffers.get("nobody") is None
+
+
+@pytest.mark.asyncio
+async def test_live_frame_during_replay_is_not_lost(mock_db, manager, monkeypatch):
+    for index in range(2):
+        await manager.send_personal_message(notification(index), "u1")
+
+    replay_entries = manager.replay_entries
+    calls = []
+
+    async def slow_replay(user_id, last_seen):
+        entries = await replay_entries(user_id, last_seen)
+        if not calls:
+            # Se publica una notificación mientras se lee el primer reenvío
+            await manager.send_personal_message(notification(2), "u1")
+        calls.append(last_seen)
+        return entries
+
+    monkeypatch.setattr(manager, "replay_entries", slow_replay)
+    websocket = FakeWebSocket()
+    connection = await manager.connect("u1", websocket, last_seen=0)
+    await drain()
+
+    received = seqs(websocket)
+    assert received[:2] == [1, 2]
+    assert set(received) == {1, 2, 3}
+    connection.stop()
+
+
+@pytest.mark.asyncio
+async def test_batch_frame_with_several_seqs(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "NOTIFICATION_COALESCE_WINDOW_SECONDS", 0.01)
+    manager = server.NotificationManager()
+    websocket = FakeWebSocket()
+    connection = await manager.connect("u1", websocket)
+
+    for index in range(3):
+        await manager.send_personal_message(notification(index), "u1")
+    await asyncio.sleep(0.05)
+    await drain()
+
+    frames = websocket.frames()
+    assert len(frames) == 1
+    batch = frames[0]
+    assert batch["type"] == "notification_batch"
+    assert batch["count"] == 3
+    assert batch["seq"] == 3
+    assert [item["seq"] for item in batch["notifications"]] == [1, 2, 3]
+    assert [item["message"] for item in batch["notifications"]] == ["n0", "n1", "n2"]
+    connection.stop()
+
+
+@pytest.mark.asyncio
+async def test_batch_of_one_is_sent_as_plain_frame(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "NOTIFICATION_COALESCE_WINDOW_SECONDS", 0.01)
+    manager = server.NotificationManager()
+    websocket = FakeWebSocket()
+    connection = await manager.connect("u1", websocket)
+
+    await manager.send_personal_message(notification(0), "u1")
+    await asyncio.sleep(0.05)
+    await drain()
+
+    assert websocket.frames() == [{**notification(0), "seq": 1}]
+    connection.stop()
+
+
+@pytest.mark.asyncio
+async def test_batches_are_per_recipient(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "NOTIFICATION_COALESCE_WINDOW_SECONDS", 0.01)
+    manager = server.NotificationManager()
+    sockets = {user_id: FakeWebSocket() for user_id in ("u1", "u2")}
+    connections = [await manager.connect(user_id, websocket) for user_id, websocket in sockets.items()]
+
+    await manager.send_personal_message(notification(0), "u1")
+    await manager.send_personal_message(notification(1), "u2")
+    await manager.send_personal_message(notification(2), "u1")
+    await asyncio.sleep(0.05)
+    await drain()
+
+    assert [item["message"] for item in sockets["u1"].frames()[0]["notifications"]] == ["n0", "n2"]
+    assert sockets["u2"].frames() == [{**notification(1), "seq": 1}]
+    for connection in connections:
+        connection.stop()